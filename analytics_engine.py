@@ -0,0 +1,330 @@
+"""
+Financial Trading Data Warehouse - Analytics Engine
+In-process columnar store of fact_trades partitions with vectorized aggregation
+
+Monthly fact_trades partitions are copied into memory once, as Arrow tables
+with compact types (int32 keys, dictionary-encoded trade types, float32 for
+prices and quantities), and every slice of them is filtered and aggregated
+with Arrow compute kernels instead of another round-trip to PostgreSQL. When
+the ETL publishes a new data version, only the partitions it loaded into (per
+etl_load_ledger) are dropped and re-read on next use. Resident months are
+capped by size, and the least recently used ones are dropped first.
+"""
+
+import io
+import re
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from sqlalchemy import text
+
+# Columns kept in memory and their in-memory types. Amounts that get summed
+# (trade_value, realized_pnl) stay float64 so totals match the database.
+COLUMNS = {
+    'trade_id': pa.int64(),
+    'trade_timestamp': pa.timestamp('us'),
+    'date_key': pa.int32(),
+    'security_key': pa.int32(),
+    'trader_key': pa.int32(),
+    'account_key': pa.int32(),
+    'trade_type': pa.dictionary(pa.int8(), pa.string()),
+    'quantity': pa.float32(),
+    'price': pa.float32(),
+    'trade_value': pa.float64(),
+    'commission': pa.float32(),
+    'realized_pnl': pa.float64(),
+}
+
+# Upper bound on the bytes of loaded partitions kept in memory
+MAX_RESIDENT_BYTES = int(os.getenv('TRADE_STORE_MAX_BYTES', 1024 ** 3))
+
+# Aggregations accepted by TradeStore.aggregate()
+AGGREGATIONS = ('sum', 'mean', 'min', 'max', 'count', 'count_distinct', 'stddev')
+
+# Bar widths TradeStore.ohlcv() chooses from, finest first
+BAR_WIDTHS = {
+    '1 minute': 60, '5 minutes': 300, '15 minutes': 900, '30 minutes': 1800,
+    '1 hour': 3600, '1 day': 86400, '1 week': 7 * 86400,
+}
+
+_PARTITION_NAME = re.compile(r'^fact_trades_(\d{4})_(\d{2})$')
+
+def _date_key(value):
+    return value.year * 10000 + value.month * 100 + value.day
+
+class TradeStore:
+    """
+    Lazily loaded, version-aware copy of fact_trades partitions
+
+    Partitions are loaded the first time a query touches their month. sync()
+    compares each partition's load fingerprint (its finished batches in
+    etl_load_ledger) and evicts only the partitions that changed; warehouses
+    without the ledger evict everything on a new version.
+
+    A month is read from the database under its own lock, so a cold month only
+    blocks the queries that need that month. Once the loaded months exceed
+    max_bytes, the least recently used ones are dropped (the most recent one
+    always stays, whatever its size).
+    """
+
+    def __init__(self, engine, max_bytes=MAX_RESIDENT_BYTES):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._month_locks = {}
+        self._tables = OrderedDict()
+        self._generation = 0
+        self._fingerprints = {}
+        self._partitions = None
+        self._version = None
+        self.stats = {'partition_loads': 0, 'rows_loaded': 0, 'evictions': 0}
+
+    # ------------------------------------------------------------------ sync
+
+    def sync(self, data_version):
+        """Drop partitions changed since the last data version seen"""
+        if data_version == self._version:
+            return
+        with self.engine.connect() as conn:
+            partitions = self._list_partitions(conn)
+            fingerprints = self._load_fingerprints(conn)
+        with self._lock:
+            for month in list(self._tables):
+                if (month not in partitions or fingerprints is None
+                        or fingerprints.get(month) != self._fingerprints.get(month)):
+                    del self._tables[month]
+            # Reads started before this sync may return old rows; they are not cached
+            self._generation += 1
+            self._partitions = partitions
+            self._fingerprints = fingerprints or {}
+            self._version = data_version
+
+    def _list_partitions(self, conn):
+        """{(year, month): partition table} for every monthly fact_trades partition"""
+        rows = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass('fact_trades');
+        """)).fetchall()
+        partitions = {}
+        for (name,) in rows:
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions[(int(match.group(1)), int(match.group(2)))] = name
+        return partitions
+
+    def _load_fingerprints(self, conn):
+        """{(year, month): (last batch finished, rows inserted)} from the load ledger, or None"""
+        if conn.execute(text("SELECT to_regclass('etl_load_ledger')")).scalar() is None:
+            return None
+        rows = conn.execute(text("""
+            SELECT substring(batch_id FROM ':([0-9]{4}_[0-9]{2}):[0-9]+$') as partition,
+                   MAX(finished_at), SUM(rows_inserted)
+            FROM etl_load_ledger
+            WHERE table_name = 'fact_trades' AND status = 'DONE'
+            GROUP BY 1;
+        """)).fetchall()
+        return {
+            (int(label[:4]), int(label[5:])): (finished, inserted)
+            for label, finished, inserted in rows if label
+        }
+
+    # ------------------------------------------------------------------ load
+
+    def _cached(self, month):
+        """The loaded table of a month, marked as most recently used (None if not loaded)"""
+        table = self._tables.get(month)
+        if table is not None:
+            self._tables.move_to_end(month)
+        return table
+
+    def _month_table(self, month):
+        """The Arrow table of one month, loaded on first use"""
+        with self._lock:
+            table = self._cached(month)
+            if table is not None:
+                return table
+            partition = (self._partitions or {}).get(month)
+            if partition is None:
+                return None
+            month_lock = self._month_locks.setdefault(month, threading.Lock())
+
+        # Only queries for this month wait for its read
+        with month_lock:
+            with self._lock:
+                table = self._cached(month)
+                if table is not None:
+                    return table
+                generation = self._generation
+            table = self._read_partition(partition)
+            with self._lock:
+                self.stats['partition_loads'] += 1
+                self.stats['rows_loaded'] += table.num_rows
+                if generation == self._generation:
+                    self._tables[month] = table
+                    self._evict()
+            return table
+
+    def _evict(self):
+        """Drop least recently used months until the loaded ones fit in max_bytes (lock held)"""
+        total = sum(table.nbytes for table in self._tables.values())
+        while total > self.max_bytes and len(self._tables) > 1:
+            _, table = self._tables.popitem(last=False)
+            total -= table.nbytes
+            self.stats['evictions'] += 1
+
+    def _read_partition(self, partition):
+        """COPY one partition out as CSV and parse it straight into typed Arrow columns"""
+        buffer = io.BytesIO()
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.copy_expert(
+                f"COPY (SELECT {', '.join(COLUMNS)} FROM {partition}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                buffer
+            )
+            cur.close()
+        finally:
+            conn.close()
+        buffer.seek(0)
+        read_types = {name: pa.string() if pa.types.is_dictionary(t) else t for name, t in COLUMNS.items()}
+        table = pa_csv.read_csv(buffer, convert_options=pa_csv.ConvertOptions(column_types=read_types))
+        table = table.set_column(
+            table.schema.get_field_index('trade_type'), 'trade_type',
+            pc.dictionary_encode(table['trade_type']).cast(COLUMNS['trade_type'])
+        )
+        return table.append_column('date', pc.cast(table['trade_timestamp'], pa.date32()))
+
+    def _months(self, start, end):
+        """Partition months overlapping [start, end] (all known months when open-ended)"""
+        months = sorted((self._partitions or {}).keys())
+        if start is not None:
+            months = [m for m in months if m >= (start.year, start.month)]
+        if end is not None:
+            months = [m for m in months if m <= (end.year, end.month)]
+        return months
+
+    # ----------------------------------------------------------------- query
+
+    def scan(self, start=None, end=None, **filters):
+        """
+        Arrow table of the trades between start and end (dates, inclusive)
+
+        filters are {column: value or list of values}, e.g. security_key=7.
+        Only the months overlapping the range are loaded and filtered.
+        """
+        pieces = []
+        for month in self._months(start, end):
+            table = self._month_table(month)
+            if table is None or table.num_rows == 0:
+                continue
+            mask = None
+            conditions = []
+            if start is not None:
+                conditions.append(pc.greater_equal(table['date_key'], _date_key(start)))
+            if end is not None:
+                conditions.append(pc.less_equal(table['date_key'], _date_key(end)))
+            for column, value in filters.items():
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                conditions.append(pc.is_in(table[column], value_set=pa.array(list(values)).cast(table.schema.field(column).type)))
+            for condition in conditions:
+                mask = condition if mask is None else pc.and_(mask, condition)
+            pieces.append(table if mask is None else table.filter(mask))
+        if not pieces:
+            return pa.table({**{name: pa.array([], t) for name, t in COLUMNS.items()}, 'date': pa.array([], pa.date32())})
+        return pa.concat_tables(pieces)
+
+    def rows(self, columns, start=None, end=None, order_by='trade_timestamp', **filters):
+        """scan() as a pandas DataFrame with only `columns`, sorted by order_by"""
+        table = self.scan(start, end, **filters)
+        if order_by:
+            table = table.sort_by(order_by)
+        return table.select(list(columns)).to_pandas()
+
+    def aggregate(self, by, measures, start=None, end=None, **filters):
+        """
+        Group the trades of scan() by `by` columns and aggregate them
+
+        measures is {output: (column, aggregation)} with aggregation one of
+        AGGREGATIONS. Float32 columns are widened to float64 before summing.
+        Returns a pandas DataFrame sorted by the grouping columns.
+        """
+        table = self.scan(start, end, **filters)
+        aggregations = []
+        for output, (column, how) in measures.items():
+            if how not in AGGREGATIONS:
+                raise ValueError(f"Unsupported aggregation: {how}")
+            if pa.types.is_floating(table.schema.field(column).type):
+                table = table.set_column(table.schema.get_field_index(column), column,
+                                         pc.cast(table[column], pa.float64()))
+            if how == 'stddev':
+                options = pc.VarianceOptions(ddof=1)
+            elif how == 'sum':
+                # Sum of a group with only NULLs is 0, as in pandas
+                options = pc.ScalarAggregateOptions(min_count=0)
+            else:
+                options = None
+            aggregations.append((column, how, options) if options else (column, how))
+
+        grouped = table.group_by(list(by), use_threads=True).aggregate(aggregations)
+        rename = {f"{column}_{how}": output for output, (column, how) in measures.items()}
+        df = grouped.to_pandas().rename(columns=rename)
+        return df[list(by) + list(measures)].sort_values(list(by)).reset_index(drop=True)
+
+    def ohlcv(self, max_bars, start=None, end=None, **filters):
+        """
+        Price bars of the trades of scan(), at most max_bars of them
+
+        Returns (width, DataFrame) with one row per bar: bar_start, open, high,
+        low, close, quantity, trade_value and trades. width is the label of the
+        finest BAR_WIDTHS entry that keeps the number of non-empty bars within
+        max_bars, or None when there are few enough trades to return each one
+        as its own bar. Weekly bars start on Thursdays (the Unix epoch).
+        """
+        table = self.scan(start, end, **filters).sort_by('trade_timestamp')
+        seconds = pc.cast(table['trade_timestamp'], pa.int64()).to_numpy() // 1_000_000
+        price = table['price'].to_numpy().astype(np.float64)
+        quantity = table['quantity'].to_numpy().astype(np.float64)
+        trade_value = table['trade_value'].to_numpy()
+
+        if len(seconds) <= max_bars:
+            return None, pd.DataFrame({
+                'bar_start': table['trade_timestamp'].to_pandas(),
+                'open': price, 'high': price, 'low': price, 'close': price,
+                'quantity': quantity, 'trade_value': trade_value, 'trades': 1,
+            })
+
+        # Finest width with few enough non-empty buckets (the last one otherwise)
+        for width, size in BAR_WIDTHS.items():
+            buckets = seconds // size
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            if len(starts) <= max_bars:
+                break
+        ends = np.r_[starts[1:], len(buckets)]
+        return width, pd.DataFrame({
+            'bar_start': pd.to_datetime(buckets[starts] * size, unit='s'),
+            'open': price[starts],
+            'high': np.maximum.reduceat(price, starts),
+            'low': np.minimum.reduceat(price, starts),
+            'close': price[ends - 1],
+            'quantity': np.add.reduceat(quantity, starts),
+            'trade_value': np.add.reduceat(trade_value, starts),
+            'trades': ends - starts,
+        })
+
+    def memory_bytes(self):
+        """Bytes held by the loaded partitions"""
+        with self._lock:
+            return sum(table.nbytes for table in self._tables.values())
+
+    def loaded_months(self):
+        with self._lock:
+            return [date(year, month, 1) for year, month in sorted(self._tables)]
@@ -0,0 +1,206 @@
+"""
+Financial Trading Data Warehouse - Price Matrix
+Dense dates x securities matrix of close prices and log returns, memory-mapped
+
+The ETL pivots historical_prices once into two float32 matrices, closes and
+daily log returns, with one row per trading date and one column per
+security_key, and writes them as raw files next to the processed tables. The
+ETL and the dashboard open them with np.memmap, so nothing is parsed or copied:
+a cross-section (every security on one date) is a row, a security's history is
+a column, and a date range is a slice of rows.
+
+Layout of a matrix directory:
+    close.f32        closes, C order (dates x securities)
+    log_return.f32   ln(close / previous close), same shape
+    dates.npy        trading dates, datetime64[D], ascending
+    security_keys.npy
+    meta.json        shape and build information
+
+The matrix path itself is a symlink to the current build, a sibling directory
+named .price_matrix-<build>. A new build is published by replacing the symlink
+in one rename, so readers always find a complete matrix.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Default location, next to the other processed tables
+DEFAULT_MATRIX_PATH = os.getenv(
+    'PRICE_MATRIX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'processed', 'price_matrix')
+)
+
+FORMAT_VERSION = 1
+
+# Builds kept next to the current one, for readers that resolved the path just
+# before a newer build was published
+KEEP_PREVIOUS_BUILDS = 1
+
+class PriceMatrix:
+    """
+    Closes and log returns of every security on every trading date
+
+    close[i, j] is the close of security_keys[j] on dates[i] (NaN if it had no
+    price that day). log_return[i, j] is the log return from the security's
+    previous close to close[i, j]; it is NaN on the first date and on dates
+    without a close. date_index and column_index map a date or a security_key
+    to its row or column.
+    """
+
+    def __init__(self, dates, security_keys, close, log_return, meta=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.security_keys = np.asarray(security_keys, dtype=np.int32)
+        self.close = close
+        self.log_return = log_return
+        self.meta = meta or {}
+        self.column_index = {int(key): column for column, key in enumerate(self.security_keys)}
+
+    @property
+    def shape(self):
+        return self.close.shape
+
+    @classmethod
+    def open(cls, path=None):
+        """Map a matrix written by write_price_matrix() (read-only, zero-copy)"""
+        # Resolve the symlink once, so every file comes from the same build
+        path = os.path.realpath(path or DEFAULT_MATRIX_PATH)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        shape = tuple(meta['shape'])
+        return cls(
+            np.load(os.path.join(path, 'dates.npy')),
+            np.load(os.path.join(path, 'security_keys.npy')),
+            np.memmap(os.path.join(path, 'close.f32'), dtype=np.float32, mode='r', shape=shape),
+            np.memmap(os.path.join(path, 'log_return.f32'), dtype=np.float32, mode='r', shape=shape),
+            meta
+        )
+
+    @classmethod
+    def from_prices(cls, prices, securities, date_column='date', price_column='close_price'):
+        """
+        Build an in-memory matrix from long-format prices (ticker, date, close)
+
+        Tickers are mapped to security_key through securities (ticker_symbol,
+        security_key); tickers without a key are dropped.
+        """
+        security_map = dict(zip(securities['ticker_symbol'], securities['security_key']))
+        keys = prices['ticker'].map(security_map)
+        valid = keys.notna().to_numpy() & prices[price_column].notna().to_numpy()
+        days = pd.to_datetime(prices[date_column]).to_numpy()[valid].astype('datetime64[D]')
+        keys = keys.to_numpy()[valid].astype(np.int64)
+
+        dates, rows = np.unique(days, return_inverse=True)
+        security_keys, columns = np.unique(keys, return_inverse=True)
+        close = np.full((len(dates), len(security_keys)), np.nan, dtype=np.float32)
+        close[rows, columns] = prices[price_column].to_numpy(dtype=np.float64)[valid]
+        return cls(dates, security_keys, close, log_returns(close))
+
+    def date_index(self, day):
+        """Row of the last trading date on or before day (-1 if day is before the first date)"""
+        return int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(day).date(), 'D'), side='right')) - 1
+
+    def rows(self, start=None, end=None):
+        """Row slice covering the trading dates in [start, end]"""
+        first = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start).date(), 'D'), side='left'))
+        last = len(self.dates) if end is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end).date(), 'D'), side='right'))
+        return slice(first, last)
+
+    def columns(self, security_keys):
+        """Column positions of security_keys (KeyError for keys not in the matrix)"""
+        return np.array([self.column_index[int(key)] for key in security_keys], dtype=np.intp)
+
+    def window(self, start=None, end=None, security_keys=None, values='close'):
+        """
+        (dates, security_keys, matrix) for a date range and optional securities
+
+        values is 'close' or 'log_return'. Without security_keys the result is a
+        view of the mapped file; selecting securities gathers their columns.
+        """
+        matrix = self.close if values == 'close' else self.log_return
+        rows = self.rows(start, end)
+        if security_keys is None:
+            return self.dates[rows], self.security_keys, matrix[rows]
+        columns = self.columns(security_keys)
+        return self.dates[rows], self.security_keys[columns], matrix[rows][:, columns]
+
+    def series(self, security_key, start=None, end=None):
+        """DataFrame of one security's close and log return over a date range"""
+        rows = self.rows(start, end)
+        column = self.column_index[int(security_key)]
+        return pd.DataFrame({
+            'date': self.dates[rows].astype('datetime64[ns]'),
+            'close': self.close[rows, column],
+            'log_return': self.log_return[rows, column],
+        })
+
+def log_returns(close):
+    """Log return of every column from its previous non-missing close"""
+    filled = pd.DataFrame(close).ffill().to_numpy(dtype=np.float64)
+    previous = np.vstack([np.full((1, close.shape[1]), np.nan), filled[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.log(close.astype(np.float64) / previous)
+    return returns.astype(np.float32)
+
+def write_price_matrix(matrix, path=None):
+    """
+    Write a PriceMatrix to path, replacing the previous matrix
+
+    The files are written into a new sibling build directory, and path (a
+    symlink) is then switched to it with os.replace, so a reader opening the
+    matrix at any moment gets either the old build or the new one. Builds
+    older than the previous one are deleted; readers that already mapped them
+    keep their mapping.
+    """
+    path = os.path.abspath(path or DEFAULT_MATRIX_PATH)
+    parent = os.path.dirname(path)
+    prefix = f".{os.path.basename(path)}-"
+    os.makedirs(parent, exist_ok=True)
+    build = f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    staging = tempfile.mkdtemp(prefix=f"{prefix}staging-", dir=parent)
+    target = os.path.join(parent, prefix + build)
+    link = os.path.join(parent, f"{prefix}link-{build}")
+    try:
+        np.ascontiguousarray(matrix.close, dtype=np.float32).tofile(os.path.join(staging, 'close.f32'))
+        np.ascontiguousarray(matrix.log_return, dtype=np.float32).tofile(os.path.join(staging, 'log_return.f32'))
+        np.save(os.path.join(staging, 'dates.npy'), matrix.dates)
+        np.save(os.path.join(staging, 'security_keys.npy'), matrix.security_keys)
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({
+                'format_version': FORMAT_VERSION,
+                'shape': list(matrix.shape),
+                'first_date': str(matrix.dates[0]) if len(matrix.dates) else None,
+                'last_date': str(matrix.dates[-1]) if len(matrix.dates) else None,
+                'build': build,
+                'built_at': datetime.now().isoformat(timespec='seconds'),
+            }, f)
+        os.rename(staging, target)
+
+        # A matrix written before builds were versioned is a plain directory,
+        # which a symlink cannot replace; move it aside once
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.rename(path, os.path.join(parent, f"{prefix}legacy-{build}"))
+        os.symlink(os.path.basename(target), link)
+        os.replace(link, path)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        if os.path.lexists(link):
+            os.remove(link)
+        raise
+
+    # Keep the current build and the previous KEEP_PREVIOUS_BUILDS
+    builds = sorted(
+        (entry for entry in os.scandir(parent)
+         if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False)
+         and not entry.name.startswith(f"{prefix}staging-") and entry.path != target),
+        key=lambda entry: entry.stat(follow_symlinks=False).st_mtime, reverse=True
+    )
+    for entry in builds[KEEP_PREVIOUS_BUILDS:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+    return path
@@ -0,0 +1,683 @@
+"""
+Financial Trading Data Warehouse - Query Router
+Routes logical metric requests to the smallest aggregate that can answer them
+
+Dashboard pages describe what they need (measures, grouping dimensions and
+filters) as a MetricQuery. The router checks every source in SOURCES - the
+ETL-maintained summary tables, the materialized views and fact_trades itself -
+and builds SQL against the smallest one whose grain, measures and trade
+population cover the request. In approximate mode (sample_percent) a request
+that would otherwise read a large source is estimated from a TABLESAMPLE of
+fact_trades, with a confidence interval for every measure.
+"""
+
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+# ============================================================================
+# DIMENSIONS
+# ============================================================================
+
+@dataclass(frozen=True)
+class Dimension:
+    """A grouping/filter dimension and the dim table holding its labels"""
+    key: str
+    table: str
+    alias: str
+    attributes: tuple = ()
+    current_only: bool = False
+
+DIMENSIONS = {
+    'account': Dimension('account_key', 'dim_account', 'a', ('account_name', 'account_type')),
+    'security': Dimension('security_key', 'dim_security', 's', ('ticker_symbol', 'security_name'), current_only=True),
+    'trader': Dimension('trader_key', 'dim_trader', 't', ('full_name', 'desk_name'), current_only=True),
+}
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+@dataclass(frozen=True)
+class Source:
+    """
+    One table or materialized view the router can read from
+
+    measures maps a trade population ('all' trades, or only 'closed' trades with
+    a realized P&L) to {measure: SQL aggregate over the alias `src`}. A source
+    that only holds closed trades has no 'all' entry. closed_where restricts an
+    'all' source to closed trades. exact_only measures cannot be re-aggregated
+    (averages, standard deviations, distinct counts already taken per row), so
+    they are only used when the request groups by exactly the source's grain.
+    freshness is 'load' for tables updated in the ETL load transaction and
+    'refresh' for materialized views, which are current as of their last refresh.
+    """
+    name: str
+    grain: frozenset
+    measures: dict
+    date_column: str = 'date_key'
+    closed_where: str = None
+    exact_only: frozenset = frozenset()
+    freshness: str = 'load'
+
+# Sample standard deviation from a count, a sum and a sum of squares
+_ROLLUP_STDDEV = (
+    "SQRT(GREATEST(SUM(src.pnl_sumsq) - SUM(src.realized_pnl) ^ 2 / NULLIF(SUM(src.pnl_count), 0), 0)"
+    " / NULLIF(SUM(src.pnl_count) - 1, 0))"
+)
+
+_TRADE_MEASURES = {
+    'trades': "COUNT(*)",
+    'buys': "COUNT(*) FILTER (WHERE src.trade_type = 'BUY')",
+    'sells': "COUNT(*) FILTER (WHERE src.trade_type = 'SELL')",
+    'quantity': "SUM(src.quantity)",
+    'volume': "SUM(src.trade_value)",
+    'commission': "SUM(src.commission)",
+    'avg_price': "AVG(src.price)",
+    'realized_pnl': "COALESCE(SUM(src.realized_pnl), 0)",
+    'avg_pnl': "AVG(src.realized_pnl)",
+    'pnl_stddev': "STDDEV(src.realized_pnl)",
+    'wins': "COUNT(*) FILTER (WHERE src.realized_pnl > 0)",
+    'positions': "COUNT(DISTINCT src.security_key)",
+    'trading_days': "COUNT(DISTINCT src.date_key)",
+}
+
+SOURCES = [
+    Source(
+        name='agg_trade_kpis',
+        grain=frozenset({'security'}),
+        measures={
+            'all': {
+                'trades': "SUM(src.trade_count)",
+                'volume': "SUM(src.total_value)",
+                'realized_pnl': "SUM(src.realized_pnl)",
+                'avg_pnl': "SUM(src.realized_pnl) / NULLIF(SUM(src.closed_trade_count), 0)",
+                'positions': "COUNT(DISTINCT src.security_key)",
+            },
+            'closed': {
+                'trades': "SUM(src.closed_trade_count)",
+                'realized_pnl': "SUM(src.realized_pnl)",
+                'avg_pnl': "SUM(src.realized_pnl) / NULLIF(SUM(src.closed_trade_count), 0)",
+                'positions': "COUNT(DISTINCT src.security_key)",
+            },
+        },
+        closed_where="src.closed_trade_count > 0",
+    ),
+    Source(
+        name='fact_daily_summary',
+        grain=frozenset({'date', 'account', 'security', 'trader'}),
+        measures={
+            'all': {
+                'trades': "SUM(src.trade_count)",
+                'buys': "SUM(src.buy_count)",
+                'sells': "SUM(src.sell_count)",
+                'quantity': "SUM(src.total_quantity)",
+                'volume': "SUM(src.total_value)",
+                'commission': "SUM(src.total_commission)",
+                'avg_price': "SUM(src.price_sum) / NULLIF(SUM(src.trade_count), 0)",
+                'realized_pnl': "SUM(src.realized_pnl)",
+                'avg_pnl': "SUM(src.realized_pnl) / NULLIF(SUM(src.pnl_count), 0)",
+                'pnl_stddev': _ROLLUP_STDDEV,
+                'wins': "SUM(src.win_count)",
+                'positions': "COUNT(DISTINCT src.security_key)",
+                'trading_days': "COUNT(DISTINCT src.date_key)",
+            },
+            'closed': {
+                'trades': "SUM(src.pnl_count)",
+                'volume': "SUM(src.closed_value)",
+                'realized_pnl': "SUM(src.realized_pnl)",
+                'avg_pnl': "SUM(src.realized_pnl) / NULLIF(SUM(src.pnl_count), 0)",
+                'pnl_stddev': _ROLLUP_STDDEV,
+                'wins': "SUM(src.win_count)",
+                'positions': "COUNT(DISTINCT src.security_key)",
+                'trading_days': "COUNT(DISTINCT src.date_key)",
+            },
+        },
+        closed_where="src.pnl_count > 0",
+    ),
+    # Closed trades only; daily_volume is the value of closing trades
+    Source(
+        name='mv_daily_portfolio_var',
+        grain=frozenset({'date', 'account'}),
+        measures={
+            'closed': {
+                'volume': "SUM(src.daily_volume)",
+                'realized_pnl': "SUM(src.daily_pnl)",
+                'avg_pnl': "MAX(src.avg_pnl_per_trade)",
+                'pnl_stddev': "MAX(src.pnl_stddev)",
+                'positions': "MAX(src.num_positions)",
+            },
+        },
+        date_column='date',
+        exact_only=frozenset({'avg_pnl', 'pnl_stddev', 'positions'}),
+        freshness='refresh',
+    ),
+    # Closed trades only, and only for current traders, so it can only stand in
+    # for per-trader rows (which join current traders anyway), never for totals
+    Source(
+        name='mv_trader_performance_mtd',
+        grain=frozenset({'trader'}),
+        measures={
+            'closed': {
+                'trades': "SUM(src.total_trades)",
+                'volume': "SUM(src.total_volume)",
+                'realized_pnl': "SUM(src.total_pnl)",
+                'avg_pnl': "MAX(src.avg_pnl)",
+                'pnl_stddev': "MAX(src.pnl_stddev)",
+                'trading_days': "MAX(src.trading_days)",
+            },
+        },
+        exact_only=frozenset({'trades', 'volume', 'realized_pnl', 'avg_pnl', 'pnl_stddev', 'trading_days'}),
+        freshness='refresh',
+    ),
+    Source(
+        name='fact_trades',
+        grain=frozenset({'date', 'account', 'security', 'trader'}),
+        measures={'all': _TRADE_MEASURES, 'closed': _TRADE_MEASURES},
+        closed_where="src.realized_pnl IS NOT NULL",
+    ),
+]
+
+# Measures computed from other measures of the same source
+DERIVED_MEASURES = {
+    'sharpe_ratio': (
+        "CASE WHEN {pnl_stddev} > 0 THEN ({avg_pnl} - 0.03) / {pnl_stddev} ELSE 0 END",
+        ('avg_pnl', 'pnl_stddev'),
+    ),
+    'win_rate': (
+        "{wins}::float / NULLIF({trades}, 0)",
+        ('wins', 'trades'),
+    ),
+}
+
+# ============================================================================
+# SAMPLED ESTIMATES
+# ============================================================================
+
+# Source that approximate queries sample with TABLESAMPLE SYSTEM
+SAMPLED_SOURCE = 'fact_trades'
+
+# Fixed seed, so a sampled query returns the same rows every time (and caches)
+SAMPLE_SEED = 42
+
+# z value of the reported confidence intervals (95%)
+CONFIDENCE_Z = 1.96
+
+# Row counts a sample can estimate: {name: condition}
+_SAMPLED_COUNTS = {
+    'trades': None,
+    'buys': "src.trade_type = 'BUY'",
+    'sells': "src.trade_type = 'SELL'",
+    'wins': "src.realized_pnl > 0",
+}
+
+# {measure: (estimator, count name or fact_trades column)}. Distinct counts
+# cannot be estimated from a sample, so queries that need them stay exact.
+_SAMPLED_MEASURES = {
+    'trades': ('count', 'trades'),
+    'buys': ('count', 'buys'),
+    'sells': ('count', 'sells'),
+    'wins': ('count', 'wins'),
+    'quantity': ('sum', 'quantity'),
+    'volume': ('sum', 'trade_value'),
+    'commission': ('sum', 'commission'),
+    'avg_price': ('mean', 'price'),
+    'realized_pnl': ('sum', 'realized_pnl'),
+    'avg_pnl': ('mean', 'realized_pnl'),
+    'pnl_stddev': ('stddev', 'realized_pnl'),
+}
+
+# ============================================================================
+# ROUTING
+# ============================================================================
+
+@dataclass(frozen=True)
+class MetricQuery:
+    """
+    A logical metric request
+
+    measures: measure names, or (output_column, measure) pairs to rename
+    by: dimensions to group by ('date', 'account', 'security', 'trader')
+    filters: {dimension: value, list of values, or (start, end) for 'date'}
+    closed_only: only count closed trades (those with a realized P&L)
+    having: (measure, operator, value) conditions on the grouped rows
+    fresh_only: skip materialized views, which may lag the last ETL load
+    sample_percent: approximate mode - when every exact source is larger than
+        this percentage of fact_trades, answer from a TABLESAMPLE of fact_trades
+        instead and add a <column>_ci column (95% confidence half-width) per measure
+    """
+    measures: tuple
+    by: tuple = ()
+    filters: tuple = ()
+    closed_only: bool = False
+    having: tuple = ()
+    order_by: str = None
+    descending: bool = False
+    limit: int = None
+    fresh_only: bool = False
+    sample_percent: float = None
+
+    @classmethod
+    def build(cls, measures, by=(), filters=None, having=(), **options):
+        """Build a hashable query from plain lists and dicts"""
+        measures = tuple(m if isinstance(m, str) else tuple(m) for m in
+                         (measures.items() if isinstance(measures, dict) else measures))
+        filters = tuple(sorted(
+            (dim, tuple(value) if isinstance(value, (list, tuple, set)) else value)
+            for dim, value in (filters or {}).items()
+        ))
+        return cls(measures=measures, by=tuple(by), filters=filters, having=tuple(having), **options)
+
+    def measure_names(self):
+        return [m if isinstance(m, str) else m[1] for m in self.measures]
+
+@dataclass
+class QueryPlan:
+    """The chosen source and the SQL that answers a MetricQuery from it"""
+    source: str
+    sql: str
+    params: dict = field(default_factory=dict)
+    candidates: list = field(default_factory=list)
+    sample_percent: float = None
+
+def date_key(value):
+    """YYYYMMDD surrogate key for a date"""
+    return value.year * 10000 + value.month * 100 + value.day
+
+def source_sizes(engine):
+    """
+    Return {source name: bytes on disk} for every source that exists
+
+    Partitioned tables are measured as the sum of their partitions. Sources that
+    are missing from the database are left out, so the router never picks them.
+    """
+    query = text("""
+        SELECT parent.relname,
+               pg_relation_size(parent.oid) + COALESCE(SUM(pg_relation_size(i.inhrelid)), 0) as size_bytes
+        FROM pg_class parent
+        LEFT JOIN pg_inherits i ON i.inhparent = parent.oid
+        WHERE parent.relname = ANY(:names)
+            AND parent.relkind IN ('r', 'p', 'm')
+            AND pg_table_is_visible(parent.oid)
+        GROUP BY parent.relname, parent.oid;
+    """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {'names': [source.name for source in SOURCES]}).fetchall()
+    return {name: int(size) for name, size in rows}
+
+def _measure_sql(source, population, measure):
+    measures = source.measures.get(population, {})
+    if measure in measures:
+        return measures[measure]
+    expression, depends_on = DERIVED_MEASURES[measure]
+    return expression.format(**{dep: f"({measures[dep]})" for dep in depends_on})
+
+def _can_answer(source, query):
+    """Return None if source can answer query, otherwise the reason it cannot"""
+    population = 'closed' if query.closed_only else 'all'
+    measures = source.measures.get(population)
+    if measures is None:
+        return f"has no {population} trade population"
+    if query.fresh_only and source.freshness != 'load':
+        return "may be stale"
+
+    needed_dims = set(query.by) | {dim for dim, _ in query.filters}
+    if not needed_dims <= source.grain:
+        return f"grain has no {', '.join(sorted(needed_dims - source.grain))}"
+
+    exact_grain = set(query.by) == source.grain
+    for measure in set(query.measure_names()) | {m for m, _, _ in query.having}:
+        base = DERIVED_MEASURES[measure][1] if measure in DERIVED_MEASURES else (measure,)
+        for name in base:
+            if name not in measures:
+                return f"has no {name}"
+            if name in source.exact_only and not exact_grain:
+                return f"{name} is only valid at its own grain"
+    return None
+
+def _build_sql(source, query):
+    population = 'closed' if query.closed_only else 'all'
+    select, group_by, joins = [], [], []
+
+    for dim in query.by:
+        if dim == 'date':
+            if source.date_column == 'date':
+                expression = "src.date"
+            else:
+                joins.append("JOIN dim_date d ON src.date_key = d.date_key")
+                expression = "d.date"
+            select.append(f"{expression} as date")
+            group_by.append(expression)
+            continue
+
+        dimension = DIMENSIONS[dim]
+        select.append(f"src.{dimension.key} as {dimension.key}")
+        group_by.append(f"src.{dimension.key}")
+        if dimension.attributes:
+            alias = dimension.alias
+            join = f"JOIN {dimension.table} {alias} ON src.{dimension.key} = {alias}.{dimension.key}"
+            if dimension.current_only:
+                join += f" AND {alias}.is_current = TRUE"
+            joins.append(join)
+            for attribute in dimension.attributes:
+                select.append(f"{alias}.{attribute}")
+                group_by.append(f"{alias}.{attribute}")
+
+    for output, measure in ((m, m) if isinstance(m, str) else m for m in query.measures):
+        select.append(f"{_measure_sql(source, population, measure)} as {output}")
+
+    where, params = _where_sql(source, query)
+    having = _having_sql(query, lambda measure: _measure_sql(source, population, measure), params)
+
+    sql = f"SELECT\n    {', '.join(select)}\nFROM {source.name} src"
+    for join in joins:
+        sql += f"\n{join}"
+    if where:
+        sql += f"\nWHERE {' AND '.join(where)}"
+    if group_by:
+        sql += f"\nGROUP BY {', '.join(group_by)}"
+    if having:
+        sql += f"\nHAVING {' AND '.join(having)}"
+    return sql + _order_sql(query) + ";", params
+
+def _where_sql(source, query):
+    """Population and filter conditions on the source rows, and their params"""
+    where, params = [], {}
+    if query.closed_only and source.closed_where:
+        where.append(source.closed_where)
+
+    for dim, value in query.filters:
+        if dim == 'date':
+            start, end = value
+            if source.date_column == 'date':
+                where.append("src.date BETWEEN :date_from AND :date_to")
+                params.update(date_from=start, date_to=end)
+            else:
+                where.append("src.date_key BETWEEN :date_from AND :date_to")
+                params.update(date_from=date_key(start), date_to=date_key(end))
+            continue
+
+        column = DIMENSIONS[dim].key
+        values = value if isinstance(value, tuple) else (value,)
+        placeholders = []
+        for i, item in enumerate(values):
+            params[f"{dim}_{i}"] = item
+            placeholders.append(f":{dim}_{i}")
+        where.append(f"src.{column} IN ({', '.join(placeholders)})")
+    return where, params
+
+def _having_sql(query, measure_sql, params):
+    """Conditions on the grouped rows; adds their values to params"""
+    having = []
+    for i, (measure, operator, value) in enumerate(query.having):
+        if operator not in ('>', '>=', '<', '<=', '=', '<>'):
+            raise ValueError(f"Unsupported HAVING operator: {operator}")
+        having.append(f"{measure_sql(measure)} {operator} :having_{i}")
+        params[f"having_{i}"] = value
+    return having
+
+def _order_sql(query):
+    order = query.order_by
+    if order is None and query.by:
+        order = 'date' if query.by[0] == 'date' else DIMENSIONS[query.by[0]].key
+    sql = ""
+    if order:
+        sql += f"\nORDER BY {order}{' DESC' if query.descending else ''}"
+    if query.limit:
+        sql += f"\nLIMIT {int(query.limit)}"
+    return sql
+
+def _sampled_measure_sql(measure, fraction):
+    """(estimate, confidence half-width) of a measure over the `t` totals of a sample"""
+    if measure in DERIVED_MEASURES:
+        expression, depends_on = DERIVED_MEASURES[measure]
+        estimates = {dep: f"({_sampled_measure_sql(dep, fraction)[0]})" for dep in depends_on}
+        return expression.format(**estimates), "NULL::numeric"
+
+    kind, name = _SAMPLED_MEASURES[measure]
+    f, z = fraction, CONFIDENCE_Z
+    if kind == 'count':
+        return f"t.c_{name} / {f}", f"{z} * SQRT((1 - {f}) * t.cc_{name}) / {f}"
+    if kind == 'sum':
+        return f"COALESCE(t.s_{name} / {f}, 0)", f"{z} * SQRT((1 - {f}) * t.ss_{name}) / {f}"
+    if kind == 'mean':
+        # Ratio estimator sum(x) / count(x), linearized over the sampled pages
+        return f"t.mu_{name}", (
+            f"{z} * SQRT(GREATEST((1 - {f}) * (t.ss_{name} - 2 * t.mu_{name} * t.sn_{name}"
+            f" + t.mu_{name} ^ 2 * t.nn_{name}), 0)) / NULLIF(t.n_{name}, 0)"
+        )
+    # stddev: linearize the variance as the mean of (x - mu)^2 - var per page,
+    # then map its interval to the standard deviation (d sqrt(v) = dv / 2 sqrt(v))
+    m, v = f"t.mu_{name}", f"t.var_{name}"
+    page_sumsq = (
+        f"t.qq_{name} + 4 * {m} ^ 2 * t.ss_{name} + ({m} ^ 2 - {v}) ^ 2 * t.nn_{name}"
+        f" - 4 * {m} * t.qs_{name} + 2 * ({m} ^ 2 - {v}) * t.qn_{name} - 4 * {m} * ({m} ^ 2 - {v}) * t.sn_{name}"
+    )
+    return f"SQRT(GREATEST({v}, 0))", (
+        f"{z} * SQRT(GREATEST((1 - {f}) * ({page_sumsq}), 0)) / NULLIF(t.n_{name}, 0)"
+        f" / NULLIF(2 * SQRT(GREATEST({v}, 0)), 0)"
+    )
+
+def _can_sample(query):
+    measures = set(query.measure_names()) | {m for m, _, _ in query.having}
+    for measure in measures:
+        base = DERIVED_MEASURES[measure][1] if measure in DERIVED_MEASURES else (measure,)
+        if not all(name in _SAMPLED_MEASURES for name in base):
+            return False
+    return True
+
+def _build_sampled_sql(source, query, sample_percent):
+    """
+    SQL estimating query from a TABLESAMPLE SYSTEM sample of source
+
+    SYSTEM keeps or drops whole pages, so the pages are the sampling units: rows
+    are first summed per page, and every estimate and interval is computed from
+    those page totals (Horvitz-Thompson with inclusion probability f). Each
+    measure gets a <column>_ci column with the half-width of its confidence
+    interval; derived measures get NULL.
+    """
+    fraction = sample_percent / 100
+    keys = ['date_key' if dim == 'date' else DIMENSIONS[dim].key for dim in query.by]
+
+    measures = set(query.measure_names()) | {m for m, _, _ in query.having}
+    base = set()
+    for measure in measures:
+        base.update(DERIVED_MEASURES[measure][1] if measure in DERIVED_MEASURES else (measure,))
+    counts = sorted({name for kind, name in map(_SAMPLED_MEASURES.get, base) if kind == 'count'})
+    columns = sorted({name for kind, name in map(_SAMPLED_MEASURES.get, base) if kind != 'count'})
+
+    # Per page: row counts, and sum / count / sum of squares of every column
+    page_select = [f"src.{key}" for key in keys]
+    for name in counts:
+        condition = _SAMPLED_COUNTS[name]
+        page_select.append(f"COUNT(*) FILTER (WHERE {condition}) as c_{name}" if condition else f"COUNT(*) as c_{name}")
+    for name in columns:
+        page_select += [f"SUM(src.{name}) as s_{name}", f"COUNT(src.{name}) as n_{name}",
+                        f"SUM(src.{name} * src.{name}) as q_{name}"]
+    page_group = [f"src.{key}" for key in keys] + ["src.tableoid", "(src.ctid::text::point)[0]"]
+
+    # Per group: totals and the sums of products of the page totals
+    total_select = [f"p.{key}" for key in keys]
+    for name in counts:
+        total_select += [f"SUM(p.c_{name}) as c_{name}", f"SUM(p.c_{name} ^ 2) as cc_{name}"]
+    for name in columns:
+        total_select += [f"SUM(p.{a}_{name}) as {a}_{name}" for a in 'snq']
+        total_select += [f"SUM(p.{a}_{name} * p.{b}_{name}) as {a}{b}_{name}"
+                         for a, b in ('ss', 'sn', 'nn', 'qq', 'qs', 'qn')]
+
+    # Per group: mean and variance of every column
+    moment_select = ["totals.*"]
+    for name in columns:
+        moment_select += [
+            f"s_{name} / NULLIF(n_{name}, 0) as mu_{name}",
+            f"(q_{name} - s_{name} ^ 2 / NULLIF(n_{name}, 0)) / NULLIF(n_{name} - 1, 0) as var_{name}",
+        ]
+
+    select, joins = [], []
+    for dim in query.by:
+        if dim == 'date':
+            joins.append("JOIN dim_date d ON t.date_key = d.date_key")
+            select.append("d.date as date")
+            continue
+        dimension = DIMENSIONS[dim]
+        select.append(f"t.{dimension.key} as {dimension.key}")
+        if dimension.attributes:
+            alias = dimension.alias
+            join = f"JOIN {dimension.table} {alias} ON t.{dimension.key} = {alias}.{dimension.key}"
+            if dimension.current_only:
+                join += f" AND {alias}.is_current = TRUE"
+            joins.append(join)
+            select += [f"{alias}.{attribute}" for attribute in dimension.attributes]
+
+    for output, measure in ((m, m) if isinstance(m, str) else m for m in query.measures):
+        estimate, interval = _sampled_measure_sql(measure, fraction)
+        select += [f"{estimate} as {output}", f"{interval} as {output}_ci"]
+
+    where, params = _where_sql(source, query)
+    having = _having_sql(query, lambda measure: _sampled_measure_sql(measure, fraction)[0], params)
+
+    sql = "WITH pages AS (\n"
+    sql += f"    SELECT {', '.join(page_select)}\n"
+    sql += f"    FROM {source.name} src TABLESAMPLE SYSTEM ({sample_percent:g}) REPEATABLE ({SAMPLE_SEED})\n"
+    if where:
+        sql += f"    WHERE {' AND '.join(where)}\n"
+    sql += f"    GROUP BY {', '.join(page_group)}\n"
+    sql += "), totals AS (\n"
+    sql += f"    SELECT {', '.join(total_select)}\n    FROM pages p\n"
+    if keys:
+        sql += f"    GROUP BY {', '.join(f'p.{key}' for key in keys)}\n"
+    sql += "), moments AS (\n"
+    sql += f"    SELECT {', '.join(moment_select)}\n    FROM totals\n"
+    sql += ")\n"
+    sql += f"SELECT\n    {', '.join(select)}\nFROM moments t"
+    for join in joins:
+        sql += f"\n{join}"
+    if having:
+        sql += f"\nWHERE {' AND '.join(having)}"
+    return sql + _order_sql(query) + ";", params
+
+def plan_query(query, sizes):
+    """
+    Pick the smallest source that can answer query and build its SQL
+
+    sizes is the output of source_sizes(). Raises ValueError when no available
+    source can answer the query, listing why each one was rejected. With
+    query.sample_percent the plan may be a sample (plan.sample_percent is set).
+    """
+    candidates, rejected = [], []
+    for source in SOURCES:
+        if source.name not in sizes:
+            rejected.append(f"{source.name}: not in the database")
+            continue
+        reason = _can_answer(source, query)
+        if reason:
+            rejected.append(f"{source.name}: {reason}")
+        else:
+            candidates.append(source)
+
+    if not candidates:
+        raise ValueError("No source can answer this query (" + "; ".join(rejected) + ")")
+
+    # Smallest on disk wins; ties keep the catalog order
+    source = min(candidates, key=lambda s: sizes[s.name])
+
+    # Approximate mode samples fact_trades only when that reads less than any exact source
+    sample_percent = query.sample_percent
+    if sample_percent is not None:
+        if not 0 < sample_percent <= 100:
+            raise ValueError(f"sample_percent must be in (0, 100], got {sample_percent}")
+        sampled = next((s for s in candidates if s.name == SAMPLED_SOURCE), None)
+        if (sampled is None or not _can_sample(query)
+                or sizes[source.name] <= sizes[SAMPLED_SOURCE] * sample_percent / 100):
+            sample_percent = None
+        else:
+            source = sampled
+
+    if sample_percent is None:
+        sql, params = _build_sql(source, query)
+    else:
+        sql, params = _build_sampled_sql(source, query, sample_percent)
+    return QueryPlan(source.name, sql, params, [s.name for s in candidates], sample_percent)
+
+# ============================================================================
+# DISTRIBUTIONS
+# ============================================================================
+
+# Distribution summaries wrap the SQL of any query (a routed plan or a raw
+# SELECT) and reduce one of its columns in the database, so only the summary
+# row or the histogram bins are sent back, however many rows the query has.
+
+def percentile_column(fraction):
+    """Output column of a percentile: 0.05 -> 'p5', 0.025 -> 'p2_5'"""
+    return 'p' + f"{fraction * 100:g}".replace('.', '_')
+
+def _distribution_values(sql, column):
+    inner = str(sql).strip().rstrip(';')
+    return f"""dist_values AS (
+    SELECT dist_source.{column}::float8 as x
+    FROM ({inner}) dist_source
+    WHERE dist_source.{column} IS NOT NULL
+)"""
+
+def distribution_sql(sql, column, percentiles=(), tail_percentile=None):
+    """
+    SQL reducing one column of sql's rows to a single summary row
+
+    Columns: count, mean, stddev, min, max, one percentile_cont column per
+    entry of percentiles (named by percentile_column()) and, with a
+    tail_percentile, tail_cutoff (that percentile) and tail_mean (the mean of
+    the values at or below it, i.e. the Expected Shortfall of a P&L series).
+    Percentiles interpolate linearly, like numpy.percentile.
+    """
+    fractions = list(percentiles)
+    if tail_percentile is not None:
+        fractions.append(tail_percentile)
+    for fraction in fractions:
+        if not 0 <= fraction <= 1:
+            raise ValueError(f"Percentiles must be fractions in [0, 1], got {fraction}")
+
+    select = [
+        "COUNT(*) as count",
+        "AVG(x) as mean",
+        "STDDEV_SAMP(x) as stddev",
+        "MIN(x) as min",
+        "MAX(x) as max",
+    ]
+    select += [f"percentile_cont({float(f)}) WITHIN GROUP (ORDER BY x) as {percentile_column(f)}" for f in percentiles]
+    tail = ""
+    if tail_percentile is not None:
+        select.append(f"percentile_cont({float(tail_percentile)}) WITHIN GROUP (ORDER BY x) as tail_cutoff")
+        tail = ",\n    (SELECT AVG(x) FROM dist_values WHERE x <= s.tail_cutoff) as tail_mean"
+    return f"""WITH {_distribution_values(sql, column)},
+dist_summary AS (
+    SELECT {', '.join(select)}
+    FROM dist_values
+)
+SELECT s.*{tail}
+FROM dist_summary s;"""
+
+def histogram_sql(sql, column, bins=50):
+    """
+    SQL counting one column of sql's rows in `bins` equal-width buckets
+
+    One row per non-empty bucket: bucket (1..bins), lo and hi (the range of
+    all values, so bucket edges are lo + (bucket - 1) * (hi - lo) / bins) and
+    count. The maximum value is counted in the last bucket; when every value
+    is the same they all land in bucket 1.
+    """
+    bins = int(bins)
+    if bins < 1:
+        raise ValueError(f"bins must be positive, got {bins}")
+    return f"""WITH {_distribution_values(sql, column)},
+dist_range AS (
+    SELECT MIN(x) as lo, MAX(x) as hi FROM dist_values
+)
+SELECT
+    CASE WHEN r.hi > r.lo THEN LEAST(width_bucket(v.x, r.lo, r.hi, {bins}), {bins}) ELSE 1 END as bucket,
+    MIN(r.lo) as lo,
+    MIN(r.hi) as hi,
+    COUNT(*) as count
+FROM dist_values v
+CROSS JOIN dist_range r
+GROUP BY 1
+ORDER BY 1;"""
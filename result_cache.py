@@ -0,0 +1,244 @@
+"""
+Financial Trading Data Warehouse - Result Cache
+Two-tier cache for dashboard query results, invalidated by ETL loads
+
+Results are keyed by normalized SQL, parameters and the warehouse data version
+(etl_data_version, bumped by the ETL after every load and aggregate refresh).
+The first tier is an in-process LRU; the second is a SQLite file that every
+dashboard process on the host (or on a shared volume) reads and fills, so a new
+replica starts warm. A result stays valid until the data version changes.
+
+Results are stored in the shared tier as Arrow IPC streams, never pickles, so
+whoever can write the file can at worst corrupt cached data, not run code in the
+dashboard. The default file lives in a private (0700) per-user directory.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+# Private per-user directory for the default shared tier
+DEFAULT_CACHE_DIR = os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'trading_dw'
+)
+
+# Shared tier location - point every replica at the same file
+DEFAULT_CACHE_PATH = os.getenv(
+    'RESULT_CACHE_PATH',
+    os.path.join(DEFAULT_CACHE_DIR, 'result_cache.sqlite')
+)
+
+def normalize_sql(sql):
+    """Collapse whitespace and drop the trailing semicolon, so formatting does not change the key"""
+    return re.sub(r'\s+', ' ', str(sql)).strip().rstrip(';').strip()
+
+def cache_key(sql, params, data_version):
+    """Stable key for one query result at one data version"""
+    payload = json.dumps(
+        {'sql': normalize_sql(sql), 'params': params or {}, 'version': str(data_version)},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def serialize_frame(df):
+    """DataFrame as an Arrow IPC stream (ValueError if a column cannot be stored in Arrow)"""
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowException, TypeError) as e:
+        raise ValueError(f"Result cannot be stored in Arrow: {e}") from e
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def deserialize_frame(payload):
+    """DataFrame from serialize_frame() output (ValueError if the payload is not a valid stream)"""
+    try:
+        return pa.ipc.open_stream(pa.py_buffer(payload)).read_all().to_pandas()
+    except pa.ArrowException as e:
+        raise ValueError(f"Invalid cached result: {e}") from e
+
+class ResultCache:
+    """
+    In-process LRU in front of a shared SQLite store
+
+    Both tiers are bounded: the LRU by entry count, the SQLite file by the total
+    size of the stored results (least recently read results are evicted first).
+    When a new data version is first seen, entries of older versions are dropped
+    from both tiers, since they can never be hit again.
+    """
+
+    def __init__(self, path=None, max_local_entries=256, max_disk_bytes=512 * 1024 * 1024):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.max_local_entries = max_local_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_versions = set()
+        self.stats = {'local_hits': 0, 'disk_hits': 0, 'misses': 0}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if directory == os.path.abspath(DEFAULT_CACHE_DIR):
+            # The default location must not be readable or writable by other users
+            os.chmod(directory, 0o700)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    cache_key TEXT PRIMARY KEY,
+                    data_version TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results(last_access)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    data_version TEXT PRIMARY KEY,
+                    first_seen REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection to the shared store, committed and closed on exit"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            # WAL lets several processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _see_version(self, data_version):
+        """
+        Drop entries of other data versions the first time a new version shows up
+
+        Versions already recorded in the store never purge again, so a process
+        that is still a few seconds behind on the version cannot wipe the
+        results another process just cached for the new one.
+        """
+        data_version = str(data_version)
+        if data_version in self._seen_versions:
+            return
+        try:
+            with self._connect() as conn:
+                is_new = conn.execute(
+                    "INSERT OR IGNORE INTO versions VALUES (?, ?)", (data_version, time.time())
+                ).rowcount == 1
+                if is_new:
+                    conn.execute("DELETE FROM results WHERE data_version <> ?", (data_version,))
+                    # Older versions stay recorded for a day so they cannot count as new again
+                    conn.execute("DELETE FROM versions WHERE first_seen < ?", (time.time() - 86400,))
+        except sqlite3.Error:
+            is_new = False
+        with self._lock:
+            if is_new:
+                self._local = OrderedDict((k, v) for k, v in self._local.items() if v[0] == data_version)
+                self._seen_versions.clear()
+            self._seen_versions.add(data_version)
+
+    def get(self, sql, params, data_version):
+        """Return the cached DataFrame, or None on a miss"""
+        self._see_version(data_version)
+        key = cache_key(sql, params, data_version)
+
+        with self._lock:
+            if key in self._local:
+                self._local.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return self._local[key][1].copy()
+
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT payload FROM results WHERE cache_key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE results SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+        except sqlite3.Error:
+            row = None
+
+        try:
+            df = None if row is None else deserialize_frame(row[0])
+        except ValueError:
+            # Unreadable entry (e.g. written by an older format): drop it and recompute
+            self._delete_disk(key)
+            df = None
+
+        if df is None:
+            self.stats['misses'] += 1
+            return None
+
+        self._put_local(key, str(data_version), df)
+        self.stats['disk_hits'] += 1
+        return df.copy()
+
+    def put(self, sql, params, data_version, df):
+        """Store a result in both tiers"""
+        self._see_version(data_version)
+        key = cache_key(sql, params, data_version)
+        # Keep a private copy - callers often add columns to the frame they get back
+        self._put_local(key, str(data_version), df.copy())
+
+        try:
+            payload = serialize_frame(df)
+        except ValueError:
+            return
+        if len(payload) > self.max_disk_bytes:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, str(data_version), payload, len(payload), now, now)
+                )
+                self._evict_disk(conn)
+        except sqlite3.Error:
+            pass
+
+    def _put_local(self, key, data_version, df):
+        with self._lock:
+            self._local[key] = (data_version, df)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    def _delete_disk(self, key):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM results WHERE cache_key = ?", (key,))
+        except sqlite3.Error:
+            pass
+
+    def _evict_disk(self, conn):
+        """Delete least recently read results until the file is under max_disk_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT cache_key, size_bytes FROM results ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM results WHERE cache_key = ?", victims)
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._local.clear()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
@@ -0,0 +1,205 @@
+"""
+Financial Trading Data Warehouse - Rolling Analytics
+Online rolling statistics, drawdowns and shrunk correlation matrices
+
+RollingStats keeps running sums over the last `window` days for every entity
+(security or account) at once. Adding a day adds the new row and subtracts the
+row leaving the window, so it costs O(entities) regardless of the window
+length. From those sums it reports rolling volatility, Sharpe ratio and beta
+against a market series, and it tracks running drawdowns. Covariance and
+correlation matrices are estimated from the days in the window with
+Ledoit-Wolf shrinkage, which keeps them well conditioned when there are
+nearly as many entities as days.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Trading days per year, for annualizing volatility and Sharpe ratios
+TRADING_DAYS = 252
+
+# Statistics recorded for every day pushed (see RollingStats.history())
+STATISTICS = ('mean', 'volatility', 'sharpe', 'beta', 'drawdown')
+
+class RollingStats:
+    """
+    Rolling window statistics of many series, updated one day at a time
+
+    Each day is a vector with one value per entity (NaN where an entity has no
+    value) plus one market value. With compounding=True the values are log
+    returns and drawdowns are percentages from the running peak of the
+    compounded level. With compounding=False they are P&L amounts and
+    drawdowns are amounts below the peak of cumulative P&L. The running sums
+    are recomputed from the window every `window` days, so rounding errors
+    from the subtractions cannot build up.
+    """
+
+    def __init__(self, entities, window, compounding=True):
+        self.entities = np.asarray(entities)
+        self.window = window
+        self.compounding = compounding
+        n = len(self.entities)
+        self._values = np.zeros((window, n))
+        self._present = np.zeros((window, n), dtype=bool)
+        self._market = np.zeros(window)
+        self._slot = 0
+        self.days = 0
+        self._sums = {name: np.zeros(n) for name in ('count', 'x', 'xx', 'xm', 'm', 'mm')}
+        self._level = np.zeros(n)
+        self._peak = np.zeros(n)
+        self.max_drawdown = np.zeros(n)
+        self.dates = []
+        self._history = {name: [] for name in STATISTICS}
+
+    # ---------------------------------------------------------------- update
+
+    def _add(self, x, present, m, sign):
+        """Add (sign=1) or remove (sign=-1) one day from the running sums"""
+        mp = np.where(present, m, 0.0)
+        sums = self._sums
+        sums['count'] += sign * present
+        sums['x'] += sign * x
+        sums['xx'] += sign * x * x
+        sums['xm'] += sign * x * mp
+        sums['m'] += sign * mp
+        sums['mm'] += sign * mp * mp
+
+    def _reanchor(self):
+        """Recompute the running sums from the days in the window"""
+        for total in self._sums.values():
+            total[:] = 0
+        for slot in range(min(self.days, self.window)):
+            self._add(self._values[slot], self._present[slot], self._market[slot], 1)
+
+    def push(self, date, values, market):
+        """Add one day: values has one entry per entity, market is a number"""
+        values = np.asarray(values, dtype=float)
+        present = np.isfinite(values)
+        x = np.where(present, values, 0.0)
+        m = float(market) if np.isfinite(market) else 0.0
+
+        if self.days >= self.window:
+            slot = self._slot
+            self._add(self._values[slot], self._present[slot], self._market[slot], -1)
+        self._values[self._slot] = x
+        self._present[self._slot] = present
+        self._market[self._slot] = m
+        self._add(x, present, m, 1)
+        self._slot = (self._slot + 1) % self.window
+        self.days += 1
+        if self.days % self.window == 0:
+            self._reanchor()
+
+        # Running level, peak and drawdown over the whole history
+        self._level += x
+        self._peak = np.maximum(self._peak, self._level)
+        drawdown = np.expm1(self._level - self._peak) if self.compounding else self._level - self._peak
+        self.max_drawdown = np.minimum(self.max_drawdown, drawdown)
+
+        self.dates.append(date)
+        current = self.stats(drawdown)
+        for name in STATISTICS:
+            self._history[name].append(current[name])
+
+    def update(self, dates, values, market):
+        """
+        Push the rows of a (dates x entities) matrix that are newer than the last day seen
+
+        Returns the number of days pushed. A matrix whose entities differ from
+        this instance's, or whose rows in the current window no longer match
+        what was pushed, cannot be extended; update() then raises ValueError and
+        the caller should build a new RollingStats.
+        """
+        dates = pd.DatetimeIndex(dates)
+        if len(values) and values.shape[1] != len(self.entities):
+            raise ValueError("Entities changed")
+        start = 0
+        if self.dates:
+            start = int(dates.searchsorted(pd.Timestamp(self.dates[-1]), side='right'))
+            overlap = min(start, self.days, self.window)
+            if overlap:
+                pushed = self.window_values()[-overlap:]
+                incoming = np.asarray(values[start - overlap:start], dtype=float)
+                if not np.allclose(np.nan_to_num(pushed), np.nan_to_num(incoming), rtol=1e-9, atol=1e-9):
+                    raise ValueError("History changed")
+        for row in range(start, len(dates)):
+            self.push(dates[row], values[row], market[row])
+        return len(dates) - start
+
+    # --------------------------------------------------------------- results
+
+    def stats(self, drawdown=None):
+        """{statistic: array over entities} for the current window"""
+        sums = self._sums
+        n = sums['count']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, sums['x'] / n, np.nan)
+            var = np.where(n > 1, (sums['xx'] - sums['x'] ** 2 / n) / (n - 1), np.nan)
+            cov_m = np.where(n > 1, (sums['xm'] - sums['x'] * sums['m'] / n) / (n - 1), np.nan)
+            var_m = np.where(n > 1, (sums['mm'] - sums['m'] ** 2 / n) / (n - 1), np.nan)
+            std = np.sqrt(np.maximum(var, 0))
+            sharpe = np.where(std > 0, mean / std * np.sqrt(TRADING_DAYS), np.nan)
+            beta = np.where(var_m > 0, cov_m / var_m, np.nan)
+        if drawdown is None:
+            drawdown = np.expm1(self._level - self._peak) if self.compounding else self._level - self._peak
+        return {
+            'mean': mean,
+            'volatility': std * np.sqrt(TRADING_DAYS),
+            'sharpe': sharpe,
+            'beta': beta,
+            'drawdown': drawdown,
+        }
+
+    def summary(self):
+        """DataFrame with one row per entity: the latest statistics and the maximum drawdown"""
+        df = pd.DataFrame(self.stats())
+        df.insert(0, 'entity', self.entities)
+        df['max_drawdown'] = self.max_drawdown
+        df['days_in_window'] = self._sums['count'].astype(int)
+        return df
+
+    def history(self, statistic):
+        """DataFrame (dates x entities) of one statistic for every day pushed"""
+        return pd.DataFrame(np.array(self._history[statistic]), index=pd.DatetimeIndex(self.dates), columns=self.entities)
+
+    def window_values(self):
+        """The days in the window, oldest first, with NaN where an entity had no value"""
+        count = min(self.days, self.window)
+        order = (np.arange(count) + (self._slot if self.days >= self.window else 0)) % self.window
+        return np.where(self._present[order], self._values[order], np.nan)
+
+def ledoit_wolf(values):
+    """
+    Ledoit-Wolf shrunk covariance of the columns of values, and the shrinkage used
+
+    Columns are standardized first, so the sample correlation is shrunk toward
+    the identity (the intensity is the Ledoit-Wolf 2004 estimate), and the
+    result is scaled back by each column's standard deviation. Missing values
+    count as zero deviations from the column mean.
+    """
+    values = np.asarray(values, dtype=float)
+    t, n = values.shape
+    mean = np.nanmean(values, axis=0)
+    deviations = np.nan_to_num(values - mean)
+    std = np.sqrt((deviations ** 2).sum(axis=0) / max(t - 1, 1))
+    scale = np.where(std > 0, std, 1.0)
+    z = deviations / scale
+
+    sample = z.T @ z / t
+    target_scale = np.trace(sample) / n
+    target = target_scale * np.eye(n)
+    # Squared Frobenius distance to the target, and the estimation error of the sample
+    d2 = ((sample - target) ** 2).sum() / n
+    b2 = (((z * z).sum(axis=1) ** 2).sum() / t - (sample ** 2).sum()) / (t * n)
+    shrinkage = 0.0 if d2 == 0 else float(np.clip(b2 / d2, 0, 1))
+
+    if target_scale == 0:
+        return np.zeros((n, n)), shrinkage
+    shrunk = shrinkage * target + (1 - shrinkage) * sample
+    return shrunk / target_scale * np.outer(std, std), shrinkage
+
+def correlation_from_covariance(covariance):
+    """Correlation matrix of a covariance matrix (NaN for constant series)"""
+    std = np.sqrt(np.diag(covariance))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / np.outer(std, std)
@@ -10,10 +10,24 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from sqlalchemy import create_engine, text
 import os
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
+from analytics_engine import TradeStore
+from price_matrix import DEFAULT_MATRIX_PATH, PriceMatrix, log_returns
+from query_router import MetricQuery, distribution_sql, histogram_sql, percentile_column, plan_query, source_sizes
+from result_cache import ResultCache
+from risk_engine import MONTE_CARLO_METHODS, SIMULATIONS, PnLMatrix, risk_table
+from rolling_analytics import RollingStats, correlation_from_covariance, ledoit_wolf
+
 # Load environment variables
 load_dotenv()
 
@@ -382,32 +396,557 @@ def init_connection():
 # Initialize connection
 engine = init_connection()
 
+# Two-tier result cache shared by every session and dashboard replica
+@st.cache_resource
+def get_result_cache():
+    """One ResultCache per process; its disk tier is shared through RESULT_CACHE_PATH"""
+    return ResultCache()
+
+def read_data_version():
+    """
+    Current warehouse data version, bumped by the ETL after every load
+
+    Warehouses without etl_data_version fall back to a 5-minute bucket, which
+    gives the same expiry as the old TTL cache.
+    """
+    fallback = f"ttl-{int(time.time() // 300)}"
+    try:
+        with engine.connect() as conn:
+            if conn.execute(text("SELECT to_regclass('etl_data_version')")).scalar() is None:
+                return fallback
+            version = conn.execute(text("SELECT version FROM etl_data_version")).scalar()
+        return fallback if version is None else f"v{version}"
+    except Exception:
+        return fallback
+
+@st.cache_data(ttl=10)
+def get_data_version():
+    """read_data_version(), re-read at most every 10 seconds"""
+    return read_data_version()
+
+def execute_query(query, params=None):
+    """Execute SQL query and return DataFrame using SQLAlchemy (raises on error)"""
+    # Use pandas read_sql with engine directly
+    if params and isinstance(params, dict):
+        # For parameterized queries - use text() and pass params
+        query_obj = text(query)
+        # Convert params dict values to list for pandas compatibility
+        # pandas read_sql expects params as dict, but SQLAlchemy 2.0 needs proper binding
+        return pd.read_sql(query_obj, engine, params=params)
+    # For non-parameterized queries
+    if ':' in query and not params:
+        # Query has :params but no params - might cause issues, use text()
+        query_obj = text(query)
+    else:
+        query_obj = text(query) if isinstance(query, str) else query
+    return pd.read_sql(query_obj, engine)
+
 # Query execution function with caching
-@st.cache_data(ttl=300)  # Cache for 5 minutes
 def run_query(query, params=None):
-    """Execute SQL query and return DataFrame using SQLAlchemy"""
-    try:
-        # Use pandas read_sql with engine directly
-        if params and isinstance(params, dict):
-            # For parameterized queries - use text() and pass params
-            query_obj = text(query)
-            # Convert params dict values to list for pandas compatibility
-            # pandas read_sql expects params as dict, but SQLAlchemy 2.0 needs proper binding
-            df = pd.read_sql(query_obj, engine, params=params)
-        else:
-            # For non-parameterized queries
-            if ':' in query and not params:
-                # Query has :params but no params - might cause issues, use text()
-                query_obj = text(query)
-            else:
-                query_obj = text(query) if isinstance(query, str) else query
-            df = pd.read_sql(query_obj, engine)
+    """Execute SQL query and return DataFrame, served from the result cache while the data version is unchanged"""
+    cache = get_result_cache()
+    version = get_data_version()
+    df = cache.get(query, params, version)
+    if df is not None:
         return df
+    try:
+        df = execute_query(query, params)
     except Exception as e:
         st.error(f"Query error: {str(e)}")
         import traceback
         st.error(f"Full error: {traceback.format_exc()}")
         return pd.DataFrame()
+    # Only successful results are cached, so a failed query is retried next time
+    cache.put(query, params, version, df)
+    return df
+
+# Independent queries of one page run side by side (one pooled connection each)
+QUERY_WORKERS = 4
+
+def run_queries(queries):
+    """
+    Run independent queries concurrently and return their DataFrames in order
+
+    queries is a list of (query, params) pairs. Cached results are served
+    directly; the misses run on QUERY_WORKERS threads, so a page waits for its
+    slowest query instead of the sum of all of them. A failed query shows its
+    error and returns an empty DataFrame, like run_query().
+    """
+    cache = get_result_cache()
+    version = get_data_version()
+    results = [cache.get(query, params, version) for query, params in queries]
+    misses = [i for i, df in enumerate(results) if df is None]
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=min(QUERY_WORKERS, len(misses))) as pool:
+            futures = {i: pool.submit(execute_query, *queries[i]) for i in misses}
+        # Errors are reported here, on the script thread, where st.error works
+        for i, future in futures.items():
+            query, params = queries[i]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                st.error(f"Query error: {str(e)}")
+                results[i] = pd.DataFrame()
+                continue
+            cache.put(query, params, version, results[i])
+    return results
+
+# Rows fetched per round-trip when exporting a whole table
+EXPORT_CHUNK_ROWS = 50000
+
+# Exports are written here and served by Streamlit's static file serving
+# (server.enableStaticServing in .streamlit/config.toml) under app/static/exports/
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'exports')
+EXPORT_URL_PATH = 'app/static/exports'
+
+# Exported files are deleted once they are this old
+EXPORT_TTL_SECONDS = 3600
+
+# Without static serving an export goes through st.download_button, which holds
+# the whole file in memory; tables larger than this are refused
+EXPORT_MAX_DOWNLOAD_ROWS = {'CSV': 250000, 'Parquet': 1000000}
+
+def cleanup_exports(max_age=EXPORT_TTL_SECONDS):
+    """Delete exported files older than max_age seconds"""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def export_table(table_name, file_format='CSV', directory=None):
+    """
+    Export a table to a CSV or Parquet file and return its path
+
+    Rows come from a server-side cursor EXPORT_CHUNK_ROWS at a time and each
+    chunk is appended to the file, so memory only ever holds one chunk. The file
+    gets a random name in directory (default EXPORT_DIR) and only appears under
+    it once complete, so a half-written export is never served.
+    """
+    directory = directory or EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    extension = 'parquet' if file_format == 'Parquet' else 'csv'
+    path = os.path.join(directory, f"{table_name}-{secrets.token_urlsafe(16)}.{extension}")
+    fd, partial = tempfile.mkstemp(suffix='.partial', dir=directory)
+    os.close(fd)
+    writer = None
+    try:
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=EXPORT_CHUNK_ROWS) as conn:
+            chunks = pd.read_sql(text(f"SELECT * FROM {table_name}"), conn, chunksize=EXPORT_CHUNK_ROWS)
+            for i, chunk in enumerate(chunks):
+                if file_format == 'Parquet':
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        # Columns that are all NULL in the first chunk are typed as strings
+                        schema = pa.schema([
+                            f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema
+                        ])
+                        writer = pq.ParquetWriter(partial, schema)
+                    writer.write_table(table.cast(writer.schema))
+                else:
+                    chunk.to_csv(partial, mode='a', header=(i == 0), index=False)
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(partial, path)
+        return path
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+
+# Most price points the Time Series chart draws; longer ranges are bucketed into bars
+MAX_PRICE_POINTS = 1500
+
+# In-process copy of the fact_trades partitions for trade-level slices
+@st.cache_resource
+def get_trade_store():
+    """One TradeStore per process, shared by every session"""
+    return TradeStore(engine)
+
+def get_trade_store_synced():
+    """The TradeStore, with partitions changed by the last ETL load evicted"""
+    store = get_trade_store()
+    store.sync(get_data_version())
+    return store
+
+# Dates x securities close/return matrix written by the ETL, memory-mapped
+def price_matrix_build():
+    """The build directory DEFAULT_MATRIX_PATH currently points to; changes with every ETL write"""
+    return os.path.realpath(DEFAULT_MATRIX_PATH)
+
+@st.cache_resource(max_entries=2)
+def open_price_matrix(build):
+    """The PriceMatrix of one build; raises when it cannot be opened, so a failure is not cached"""
+    return PriceMatrix.open(build)
+
+def get_price_matrix(build=None):
+    """The ETL's PriceMatrix (the current build by default), or None when this host has no copy of it"""
+    try:
+        return open_price_matrix(build or price_matrix_build())
+    except (OSError, ValueError, KeyError):
+        return None
+
+# Size of every aggregate source, so the query router can pick the smallest one
+@st.cache_data(ttl=300)
+def get_source_sizes():
+    """Return {source: bytes} for the router's sources that exist in the database"""
+    try:
+        return source_sizes(engine)
+    except Exception:
+        # Without catalog access, answer everything from the fact table
+        return {'fact_trades': 0}
+
+def approximate_sample_percent():
+    """Sample percentage chosen in the sidebar, or None in exact mode"""
+    if st.session_state.get('approximate_mode'):
+        return st.session_state.get('sample_percent')
+    return None
+
+def plan_metrics(measures, by=(), filters=None, **options):
+    """Return (sql, params) for a metric request, or None after showing why it cannot be planned"""
+    options.setdefault('sample_percent', approximate_sample_percent())
+    query = MetricQuery.build(measures, by=by, filters=filters, **options)
+    try:
+        plan = plan_query(query, get_source_sizes())
+    except ValueError as e:
+        st.error(f"Query error: {str(e)}")
+        return None
+    return plan.sql, plan.params or None
+
+def get_metrics(measures, by=(), filters=None, **options):
+    """
+    Return measures grouped by dimensions, read from the smallest source that has them
+
+    measures is a list of measure names or a dict {output_column: measure};
+    see query_router for the available measures, dimensions and options.
+    """
+    return get_metrics_batch([dict(measures=measures, by=by, filters=filters, **options)])[0]
+
+def get_metrics_batch(requests):
+    """
+    get_metrics() for several independent requests, run concurrently
+
+    requests is a list of get_metrics() keyword argument dicts; returns the
+    DataFrames in the same order.
+    """
+    plans = [plan_metrics(**request) for request in requests]
+    results = run_queries([plan for plan in plans if plan is not None])
+    return [pd.DataFrame() if plan is None else results.pop(0) for plan in plans]
+
+# Buckets of the histograms computed in the database
+HISTOGRAM_BINS = 50
+
+def get_distribution(sql, params, column, percentiles=(), tail_percentile=None, bins=HISTOGRAM_BINS):
+    """
+    Summary statistics and histogram of one column of a query, computed in the database
+
+    Only the summary row and the non-empty buckets are transferred, never the
+    rows of the query itself. Returns (summary, histogram): summary is a Series
+    (see query_router.distribution_sql) or None when there are no values, and
+    histogram has bin_start, bin_end and count columns.
+    """
+    summary, histogram = run_queries([
+        (distribution_sql(sql, column, percentiles, tail_percentile), params),
+        (histogram_sql(sql, column, bins), params),
+    ])
+    if summary.empty or not summary['count'].iloc[0]:
+        return None, pd.DataFrame(columns=['bin_start', 'bin_end', 'count'])
+    width = ((histogram['hi'] - histogram['lo']) / bins).where(lambda w: w > 0, 1.0)
+    histogram = histogram.assign(bin_start=histogram['lo'] + (histogram['bucket'] - 1) * width)
+    histogram['bin_end'] = histogram['bin_start'] + width
+    return summary.iloc[0], histogram[['bin_start', 'bin_end', 'count']]
+
+# ============================================================================
+# PAGE QUERIES AND BACKGROUND WARM-UP
+# ============================================================================
+
+# Fixed queries of the pages, warmed in the background so no visitor sees a cold
+# page. Each entry returns get_metrics() arguments; relative dates are evaluated
+# when the query runs.
+PAGE_QUERIES = {
+    'overview_kpis': lambda: dict(
+        measures={
+            'total_trades': 'trades',
+            'total_value': 'volume',
+            'unique_securities': 'positions',
+            'total_pnl': 'realized_pnl'
+        }
+    ),
+    'overview_daily_activity': lambda: dict(
+        measures={'trade_count': 'trades', 'daily_volume': 'volume', 'daily_pnl': 'realized_pnl'},
+        by=['date'],
+        filters={'date': (datetime.now().date() - timedelta(days=30), datetime.now().date())}
+    ),
+    'top_securities': lambda: dict(
+        measures={'trade_count': 'trades', 'total_volume': 'volume', 'avg_price': 'avg_price'},
+        by=['security'],
+        order_by='total_volume', descending=True, limit=10
+    ),
+    'trader_performance': lambda: dict(
+        measures={
+            'trading_days': 'trading_days',
+            'total_trades': 'trades',
+            'total_volume': 'volume',
+            'total_pnl': 'realized_pnl',
+            'avg_pnl': 'avg_pnl',
+            'pnl_stddev': 'pnl_stddev',
+            'sharpe_ratio': 'sharpe_ratio'
+        },
+        by=['trader'],
+        closed_only=True,
+        order_by='total_pnl', descending=True
+    ),
+    # Always exact: sampling noise in the daily totals would widen the VaR tail
+    'daily_pnl': lambda: dict(
+        measures={'daily_pnl': 'realized_pnl'}, by=['date'], closed_only=True, sample_percent=None
+    ),
+    # Daily P&L per entity for the risk engine (desks roll up from traders)
+    'daily_pnl_by_account': lambda: dict(
+        measures={'daily_pnl': 'realized_pnl'}, by=['date', 'account'], closed_only=True, sample_percent=None
+    ),
+    'daily_pnl_by_trader': lambda: dict(
+        measures={'daily_pnl': 'realized_pnl'}, by=['date', 'trader'], closed_only=True, sample_percent=None
+    ),
+    'daily_pnl_by_security': lambda: dict(
+        measures={'daily_pnl': 'realized_pnl'}, by=['date', 'security'], closed_only=True, sample_percent=None
+    ),
+    # Daily average trade price per security, for returns when there is no price matrix
+    'daily_price_by_security': lambda: dict(
+        measures={'avg_price': 'avg_price'}, by=['date', 'security'], sample_percent=None
+    ),
+    'account_risk': lambda: dict(
+        measures={
+            'trade_count': 'trades',
+            'total_volume': 'volume',
+            'total_pnl': 'realized_pnl',
+            'pnl_stddev': 'pnl_stddev',
+            'avg_pnl': 'avg_pnl',
+            'sharpe_ratio': 'sharpe_ratio'
+        },
+        by=['account'],
+        closed_only=True,
+        having=[('trades', '>', 10)],
+        order_by='total_pnl', descending=True
+    ),
+    'security_list': lambda: dict(
+        measures=['trades'], by=['security'], order_by='ticker_symbol'
+    ),
+}
+
+# How often the warm-up thread checks for a new data version
+WARMUP_POLL_SECONDS = 30
+
+# Queries warmed in parallel (one pooled connection each)
+WARMUP_WORKERS = 4
+
+def show_sample_note(df):
+    """Caption results that were estimated from a sample (they carry *_ci columns)"""
+    if any(column.endswith('_ci') for column in df.columns):
+        st.caption(
+            f"⚡ Approximate: estimated from a {approximate_sample_percent():g}% sample of fact_trades. "
+            "± values and error bars are 95% confidence intervals; turn off approximate mode for exact figures."
+        )
+
+def get_page_metrics(name):
+    """Run one of PAGE_QUERIES through get_metrics()"""
+    return get_metrics(**PAGE_QUERIES[name]())
+
+def get_page_metrics_batch(*names):
+    """Run several PAGE_QUERIES entries concurrently; returns the DataFrames in order"""
+    return get_metrics_batch([PAGE_QUERIES[name]() for name in names])
+
+# Risk breakdowns: {label: (PAGE_QUERIES entry, entity column, display column)}
+RISK_BREAKDOWNS = {
+    'Account': ('daily_pnl_by_account', 'account_key', 'account_name'),
+    'Desk': ('daily_pnl_by_trader', 'desk_name', 'desk_name'),
+    'Trader': ('daily_pnl_by_trader', 'trader_key', 'full_name'),
+    'Security': ('daily_pnl_by_security', 'security_key', 'ticker_symbol'),
+}
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_entity_risk(breakdown, confidence, horizon, method, data_version):
+    """
+    risk_table() for every entity of a breakdown plus the whole portfolio
+
+    One query returns the daily P&L of all entities, which is pivoted into a
+    dates x entities matrix and evaluated in a single vectorized pass. Cached
+    per data version, so the simulations only rerun after an ETL load.
+    """
+    query_name, entity_column, label_column = RISK_BREAKDOWNS[breakdown]
+    daily = get_page_metrics(query_name)
+    if daily.empty:
+        return pd.DataFrame()
+    matrix = PnLMatrix.from_frame(daily, entity_column, 'daily_pnl').with_total()
+    risk = risk_table(matrix, confidence / 100, horizon=horizon, method=method)
+    labels = dict(zip(daily[entity_column], daily[label_column]))
+    risk.insert(1, breakdown.lower(), risk['entity'].map(labels).fillna(risk['entity']))
+    return risk
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_rolling_inputs(universe, data_version, matrix_build):
+    """
+    (dates, entity keys, labels, daily values, market series) of a universe
+
+    Securities use the log returns of the ETL's price matrix, or of the daily
+    average trade price when this host has no price matrix; their market is the
+    equal-weighted mean return. Accounts use daily realized P&L against the
+    whole portfolio's P&L. Results are cached per data version and price
+    matrix build, so a new matrix is used as soon as the ETL publishes it.
+    """
+    if universe == 'Accounts':
+        daily = get_page_metrics('daily_pnl_by_account')
+        if daily.empty:
+            return None
+        matrix = PnLMatrix.from_frame(daily, 'account_key', 'daily_pnl')
+        labels = dict(zip(daily['account_key'], daily['account_name']))
+        values = matrix.values
+        return pd.DatetimeIndex(matrix.dates), matrix.entities, [labels[key] for key in matrix.entities], values, values.sum(axis=1)
+
+    securities = get_page_metrics('security_list')
+    labels = dict(zip(securities['security_key'], securities['ticker_symbol'])) if not securities.empty else {}
+    price_matrix = get_price_matrix(matrix_build)
+    if price_matrix is not None:
+        dates, keys, values = price_matrix.dates.astype('datetime64[ns]'), price_matrix.security_keys, np.asarray(price_matrix.log_return, dtype=float)
+    else:
+        daily = get_page_metrics('daily_price_by_security')
+        if daily.empty:
+            return None
+        prices = daily.pivot(index='date', columns='security_key', values='avg_price').sort_index()
+        dates, keys, values = prices.index, prices.columns.to_numpy(), log_returns(prices.to_numpy(dtype=float)).astype(float)
+    present = np.isfinite(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        market = np.where(present, values, 0.0).sum(axis=1) / present.sum(axis=1)
+    return pd.DatetimeIndex(dates), np.asarray(keys), [labels.get(key, str(key)) for key in keys], values, market
+
+@st.cache_resource
+def get_rolling_state(universe, window):
+    """Process-wide holder of the RollingStats of one universe and window"""
+    return {'stats': None, 'lock': threading.Lock()}
+
+def get_rolling_stats(universe, window):
+    """
+    RollingStats of a universe, extended with only the days added since the last call
+
+    After an ETL load the new days are pushed onto the existing state (O(entities)
+    per day). It is rebuilt from scratch only when the entities or the days
+    already in the window changed.
+    """
+    inputs = get_rolling_inputs(universe, get_data_version(), price_matrix_build())
+    if inputs is None:
+        return None, None
+    dates, keys, labels, values, market = inputs
+    state = get_rolling_state(universe, window)
+    with state['lock']:
+        stats = state['stats']
+        if stats is None or not np.array_equal(stats.entities, keys):
+            stats = None
+        else:
+            try:
+                stats.update(dates, values, market)
+            except ValueError:
+                stats = None
+        if stats is None:
+            stats = RollingStats(keys, window, compounding=(universe == 'Securities'))
+            stats.update(dates, values, market)
+            state['stats'] = stats
+    return stats, dict(zip(keys, labels))
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_shrunk_correlation(universe, window, data_version, matrix_build):
+    """(correlation DataFrame, shrinkage) over the current window, Ledoit-Wolf shrunk"""
+    stats, labels = get_rolling_stats(universe, window)
+    if stats is None or stats.days < 2:
+        return pd.DataFrame(), None
+    covariance, shrinkage = ledoit_wolf(stats.window_values())
+    names = [labels[key] for key in stats.entities]
+    return pd.DataFrame(correlation_from_covariance(covariance), index=names, columns=names), shrinkage
+
+# P&L distributions of the Risk page: {label: (query, column)}, where query is a
+# PAGE_QUERIES entry or raw SQL
+RISK_DISTRIBUTIONS = {
+    'Daily Portfolio P&L': ('daily_pnl', 'daily_pnl'),
+    'Daily P&L per Account': ('daily_pnl_by_account', 'daily_pnl'),
+    'Realized P&L per Trade': ("SELECT realized_pnl FROM fact_trades WHERE realized_pnl IS NOT NULL", 'realized_pnl'),
+}
+
+def get_risk_distribution(label, percentiles=(), tail_percentile=None):
+    """get_distribution() of one of RISK_DISTRIBUTIONS"""
+    query, column = RISK_DISTRIBUTIONS[label]
+    if query in PAGE_QUERIES:
+        plan = plan_metrics(**PAGE_QUERIES[query]())
+        if plan is None:
+            return None, pd.DataFrame()
+        sql, params = plan
+    else:
+        sql, params = query, None
+    return get_distribution(sql, params, column, percentiles, tail_percentile)
+
+def warm_page_queries(cache, version):
+    """
+    Run every PAGE_QUERIES entry that is not cached for version yet and cache it
+
+    Queries run in parallel on WARMUP_WORKERS threads. Returns the number of
+    queries that were executed; failures are left for the page to report.
+    Plans use the same cached get_source_sizes() snapshot as the pages, so a
+    warmed query routes to the same source, and gets the same cache key, as the
+    page request it stands in for.
+    """
+    sizes = get_source_sizes()
+
+    plans = []
+    for spec in PAGE_QUERIES.values():
+        args = spec()
+        try:
+            plan = plan_query(MetricQuery.build(args.pop('measures'), **args), sizes)
+        except ValueError:
+            continue
+        params = plan.params or None
+        if cache.get(plan.sql, params, version) is None:
+            plans.append((plan.sql, params))
+
+    def warm(sql, params):
+        cache.put(sql, params, version, execute_query(sql, params))
+
+    with ThreadPoolExecutor(max_workers=WARMUP_WORKERS) as pool:
+        futures = [pool.submit(warm, sql, params) for sql, params in plans]
+        return sum(1 for future in futures if future.exception() is None)
+
+@st.cache_resource
+def start_query_warmup():
+    """
+    Start the warm-up thread once per process
+
+    The thread warms the page queries at start-up and again whenever the data
+    version changes (an ETL load, or the 5-minute expiry without
+    etl_data_version) or the date rolls over.
+    """
+    cache = get_result_cache()
+
+    def run():
+        warmed = None
+        while True:
+            current = (read_data_version(), datetime.now().date())
+            if current != warmed:
+                try:
+                    warm_page_queries(cache, current[0])
+                    warmed = current
+                except Exception:
+                    pass
+            time.sleep(WARMUP_POLL_SECONDS)
+
+    thread = threading.Thread(target=run, name='query-warmup', daemon=True)
+    thread.start()
+    return thread
+
+start_query_warmup()
 
 # ============================================================================
 # SIDEBAR NAVIGATION
@@ -417,7 +956,25 @@ st.sidebar.title("📊 Navigation")
 page = st.sidebar.radio(
     "Select Dashboard",
     ["🏠 Overview", "💼 Portfolio Analytics", "👥 Trader Performance", 
-     "⚠️ Risk Analysis", "📈 Time Series", "🔍 Data Explorer", "🏗️ Data Warehouse Architecture"]
+     "⚠️ Risk Analysis", "📈 Time Series", "📉 Rolling Risk & Correlation", "🔍 Data Explorer",
+     "🏗️ Data Warehouse Architecture"]
+)
+
+# Approximate mode: aggregates that would scan a large source read a sample of
+# fact_trades instead and report confidence intervals
+st.sidebar.markdown("---")
+st.sidebar.toggle(
+    "⚡ Fast approximate mode",
+    key='approximate_mode',
+    help="Estimate large aggregates from a TABLESAMPLE of fact_trades. "
+         "Queries served by small summary tables stay exact."
+)
+st.sidebar.select_slider(
+    "Sample size (% of fact_trades)",
+    options=[1, 2, 5, 10, 25],
+    value=5,
+    key='sample_percent',
+    disabled=not st.session_state.get('approximate_mode')
 )
 
 # ============================================================================
@@ -432,30 +989,24 @@ if page == "🏠 Overview":
     st.subheader("📊 Key Metrics")
     
     col1, col2, col3, col4 = st.columns(4)
+    # Every Overview query runs at once; the sections below only render
+    kpis, daily_activity, top_securities = get_page_metrics_batch(
+        'overview_kpis', 'overview_daily_activity', 'top_securities'
+    )
+    kpis = kpis.iloc[0].fillna(0) if not kpis.empty else pd.Series(0, index=kpis.columns)
     
     with col1:
-        total_trades = run_query("SELECT COUNT(*) as count FROM fact_trades;")
-        st.metric("Total Trades", f"{total_trades['count'].iloc[0]:,}")
+        st.metric("Total Trades", f"{int(kpis['total_trades']):,}")
     
     with col2:
-        total_value = run_query("""
-            SELECT SUM(trade_value) as total 
-            FROM fact_trades;
-        """)
-        value = total_value['total'].iloc[0] if not total_value.empty else 0
+        value = float(kpis['total_value'])
         st.metric("Total Trade Value", f"${value:,.0f}")
     
     with col3:
-        unique_securities = run_query("SELECT COUNT(DISTINCT security_key) as count FROM fact_trades;")
-        st.metric("Unique Securities", f"{unique_securities['count'].iloc[0]:,}")
+        st.metric("Unique Securities", f"{int(kpis['unique_securities']):,}")
     
     with col4:
-        total_pnl = run_query("""
-            SELECT SUM(realized_pnl) as total 
-            FROM fact_trades 
-            WHERE realized_pnl IS NOT NULL;
-        """)
-        pnl = total_pnl['total'].iloc[0] if not total_pnl.empty else 0
+        pnl = float(kpis['total_pnl'])
         st.metric("Total Realized P&L", f"${pnl:,.0f}", 
                  delta=f"{pnl/1000000:.1f}M" if pnl != 0 else "0")
     
@@ -464,19 +1015,6 @@ if page == "🏠 Overview":
     # Recent Activity Chart
     st.subheader("📈 Daily Trading Activity (Last 30 Days)")
     
-    daily_activity = run_query("""
-        SELECT 
-            d.date,
-            COUNT(*) as trade_count,
-            SUM(ft.trade_value) as daily_volume,
-            SUM(ft.realized_pnl) as daily_pnl
-        FROM fact_trades ft
-        JOIN dim_date d ON ft.date_key = d.date_key
-        WHERE d.date >= CURRENT_DATE - INTERVAL '30 days'
-        GROUP BY d.date
-        ORDER BY d.date;
-    """)
-    
     if not daily_activity.empty:
         fig = make_subplots(
             rows=2, cols=1,
@@ -530,26 +1068,12 @@ if page == "🏠 Overview":
     # Top Securities
     st.subheader("🏆 Top 10 Securities by Volume")
     
-    top_securities = run_query("""
-        SELECT 
-            s.ticker_symbol,
-            s.security_name,
-            COUNT(*) as trade_count,
-            SUM(ft.trade_value) as total_volume,
-            AVG(ft.price) as avg_price
-        FROM fact_trades ft
-        JOIN dim_security s ON ft.security_key = s.security_key
-        WHERE s.is_current = TRUE
-        GROUP BY s.ticker_symbol, s.security_name
-        ORDER BY total_volume DESC
-        LIMIT 10;
-    """)
-    
     if not top_securities.empty:
         fig = px.bar(
             top_securities,
             x='ticker_symbol',
             y='total_volume',
+            error_y='total_volume_ci' if 'total_volume_ci' in top_securities else None,
             hover_data=['security_name', 'trade_count', 'avg_price'],
             labels={'ticker_symbol': 'Ticker', 'total_volume': 'Total Volume ($)'},
             color='total_volume',
@@ -557,6 +1081,7 @@ if page == "🏠 Overview":
         )
         fig.update_layout(showlegend=False, height=400)
         st.plotly_chart(fig, width='stretch')
+        show_sample_note(top_securities)
 
 # ============================================================================
 # PORTFOLIO ANALYTICS PAGE
@@ -583,111 +1108,94 @@ elif page == "💼 Portfolio Analytics":
         if selected_accounts:
             account_list = tuple(selected_accounts)
             
-            # Portfolio Metrics
-            st.subheader("📊 Portfolio Metrics")
-            
-            col1, col2, col3, col4 = st.columns(4)
+            # The date range widget sits in the last section, but its value is
+            # needed up front so all three queries can run together
+            metrics_section, composition_section, timeline_section = st.container(), st.container(), st.container()
             
-            portfolio_metrics = run_query(f"""
-                SELECT 
-                    COUNT(DISTINCT ft.security_key) as positions,
-                    SUM(ft.trade_value) as total_volume,
-                    SUM(ft.realized_pnl) as total_pnl,
-                    AVG(ft.realized_pnl) as avg_pnl
-                FROM fact_trades ft
-                WHERE ft.account_key IN {account_list if len(account_list) > 1 else f"({account_list[0]})"};
-            """)
+            with timeline_section:
+                # Portfolio Performance Over Time
+                st.subheader("📈 Portfolio Performance Over Time")
             
-            if not portfolio_metrics.empty:
-                with col1:
-                    st.metric("Positions", f"{portfolio_metrics['positions'].iloc[0]:,}")
-                with col2:
-                    st.metric("Total Volume", f"${portfolio_metrics['total_volume'].iloc[0]:,.0f}")
-                with col3:
-                    st.metric("Total P&L", f"${portfolio_metrics['total_pnl'].iloc[0]:,.0f}")
-                with col4:
-                    st.metric("Avg P&L per Trade", f"${portfolio_metrics['avg_pnl'].iloc[0]:,.2f}")
+                date_range = st.date_input(
+                    "Select Date Range",
+                    value=(datetime.now().date() - timedelta(days=90), datetime.now().date()),
+                    max_value=datetime.now().date()
+                )
             
-            # Portfolio Composition
-            st.subheader("📊 Portfolio Composition by Security")
+            requests = [
+                dict(
+                    measures={'positions': 'positions', 'total_volume': 'volume', 'total_pnl': 'realized_pnl', 'avg_pnl': 'avg_pnl'},
+                    filters={'account': account_list}
+                ),
+                dict(
+                    measures={'total_value': 'volume', 'total_pnl': 'realized_pnl', 'trade_count': 'trades'},
+                    by=['security'],
+                    filters={'account': account_list},
+                    order_by='total_value', descending=True
+                ),
+            ]
+            if len(date_range) == 2:
+                requests.append(dict(
+                    measures={'daily_volume': 'volume', 'daily_pnl': 'realized_pnl', 'trade_count': 'trades'},
+                    by=['date'],
+                    filters={'account': account_list, 'date': (date_range[0], date_range[1])}
+                ))
+            portfolio_metrics, portfolio_composition, *timeline = get_metrics_batch(requests)
+            portfolio_timeline = timeline[0] if timeline else pd.DataFrame()
             
-            portfolio_composition = run_query(f"""
-                SELECT 
-                    s.ticker_symbol,
-                    s.security_name,
-                    SUM(ft.trade_value) as total_value,
-                    SUM(ft.realized_pnl) as total_pnl,
-                    COUNT(*) as trade_count
-                FROM fact_trades ft
-                JOIN dim_security s ON ft.security_key = s.security_key
-                WHERE ft.account_key IN {account_list if len(account_list) > 1 else f"({account_list[0]})"}
-                    AND s.is_current = TRUE
-                GROUP BY s.ticker_symbol, s.security_name
-                ORDER BY total_value DESC;
-            """)
+            with metrics_section:
+                # Portfolio Metrics
+                st.subheader("📊 Portfolio Metrics")
             
-            if not portfolio_composition.empty:
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    # Pie chart
-                    fig_pie = px.pie(
-                        portfolio_composition.head(10),
-                        values='total_value',
-                        names='ticker_symbol',
-                        title="Top 10 Holdings by Value"
-                    )
-                    st.plotly_chart(fig_pie, width='stretch')
-                
-                with col2:
-                    # Bar chart
-                    fig_bar = px.bar(
-                        portfolio_composition.head(10),
-                        x='ticker_symbol',
-                        y='total_pnl',
-                        color='total_pnl',
-                        color_continuous_scale=[[0, '#1e3a8a'], [0.5, '#3b82f6'], [1, '#f59e0b']],
-                        title="P&L by Security (Top 10)"
-                    )
-                    st.plotly_chart(fig_bar, width='stretch')
+                col1, col2, col3, col4 = st.columns(4)
             
-            # Portfolio Performance Over Time
-            st.subheader("📈 Portfolio Performance Over Time")
+                if not portfolio_metrics.empty:
+                    with col1:
+                        st.metric("Positions", f"{portfolio_metrics['positions'].iloc[0]:,}")
+                    with col2:
+                        st.metric("Total Volume", f"${portfolio_metrics['total_volume'].iloc[0]:,.0f}")
+                    with col3:
+                        st.metric("Total P&L", f"${portfolio_metrics['total_pnl'].iloc[0]:,.0f}")
+                    with col4:
+                        st.metric("Avg P&L per Trade", f"${portfolio_metrics['avg_pnl'].iloc[0]:,.2f}")
             
-            date_range = st.date_input(
-                "Select Date Range",
-                value=(datetime.now().date() - timedelta(days=90), datetime.now().date()),
-                max_value=datetime.now().date()
-            )
+            with composition_section:
+                # Portfolio Composition
+                st.subheader("📊 Portfolio Composition by Security")
             
-            if len(date_range) == 2:
-                # Build account filter - use parameterized query
-                account_placeholders = ','.join([f':acc_{i}' for i in range(len(account_list))])
-                account_params = {f'acc_{i}': acc for i, acc in enumerate(account_list)}
-                account_params['start_date'] = date_range[0]
-                account_params['end_date'] = date_range[1]
+                if not portfolio_composition.empty:
+                    col1, col2 = st.columns(2)
                 
-                portfolio_timeline = run_query(f"""
-                    SELECT 
-                        d.date,
-                        SUM(ft.trade_value) as daily_volume,
-                        SUM(ft.realized_pnl) as daily_pnl,
-                        COUNT(*) as trade_count
-                    FROM fact_trades ft
-                    JOIN dim_date d ON ft.date_key = d.date_key
-                    WHERE ft.account_key IN ({account_placeholders})
-                        AND d.date BETWEEN :start_date AND :end_date
-                    GROUP BY d.date
-                    ORDER BY d.date;
-                """, params=account_params)
+                    with col1:
+                        # Pie chart
+                        fig_pie = px.pie(
+                            portfolio_composition.head(10),
+                            values='total_value',
+                            names='ticker_symbol',
+                            title="Top 10 Holdings by Value"
+                        )
+                        st.plotly_chart(fig_pie, width='stretch')
                 
+                    with col2:
+                        # Bar chart
+                        fig_bar = px.bar(
+                            portfolio_composition.head(10),
+                            x='ticker_symbol',
+                            y='total_pnl',
+                            color='total_pnl',
+                            color_continuous_scale=[[0, '#1e3a8a'], [0.5, '#3b82f6'], [1, '#f59e0b']],
+                            title="P&L by Security (Top 10)"
+                        )
+                        st.plotly_chart(fig_bar, width='stretch')
+            
+            with timeline_section:
                 if not portfolio_timeline.empty:
                     fig = make_subplots(
                         rows=2, cols=1,
                         subplot_titles=('Daily Volume', 'Cumulative P&L'),
                         vertical_spacing=0.1
                     )
-                    
+                
                     fig.add_trace(
                         go.Scatter(
                             x=portfolio_timeline['date'],
@@ -699,7 +1207,7 @@ elif page == "💼 Portfolio Analytics":
                         ),
                         row=1, col=1
                     )
-                    
+                
                     portfolio_timeline['cumulative_pnl'] = portfolio_timeline['daily_pnl'].cumsum()
                     fig.add_trace(
                         go.Scatter(
@@ -713,7 +1221,7 @@ elif page == "💼 Portfolio Analytics":
                         ),
                         row=2, col=1
                     )
-                    
+                
                     fig.update_layout(
                         height=600, 
                         showlegend=False,
@@ -724,7 +1232,7 @@ elif page == "💼 Portfolio Analytics":
                     fig.update_xaxes(title_text="Date", row=2, col=1, gridcolor='rgba(226, 232, 240, 0.5)')
                     fig.update_yaxes(title_text="Volume ($)", row=1, col=1, gridcolor='rgba(226, 232, 240, 0.5)')
                     fig.update_yaxes(title_text="Cumulative P&L ($)", row=2, col=1, gridcolor='rgba(226, 232, 240, 0.5)')
-                    
+                
                     st.plotly_chart(fig, width='stretch')
 
 # ============================================================================
@@ -735,22 +1243,8 @@ elif page == "👥 Trader Performance":
     st.title("👥 Trader Performance Metrics")
     st.markdown("---")
     
-    # Use materialized view for performance
-    trader_performance = run_query("""
-        SELECT 
-            trader_key,
-            full_name,
-            desk_name,
-            trading_days,
-            total_trades,
-            total_volume,
-            total_pnl,
-            avg_pnl,
-            pnl_stddev,
-            sharpe_ratio
-        FROM mv_trader_performance_mtd
-        ORDER BY total_pnl DESC;
-    """)
+    # Closed-trade performance per trader (served by mv_trader_performance_mtd when it exists)
+    trader_performance = get_page_metrics('trader_performance')
     
     if not trader_performance.empty:
         # Top Performers
@@ -885,62 +1379,71 @@ elif page == "⚠️ Risk Analysis":
         value=95
     )
     
-    # Get daily P&L data
-    daily_pnl = run_query("""
-        SELECT 
-            d.date,
-            SUM(ft.realized_pnl) as daily_pnl
-        FROM fact_trades ft
-        JOIN dim_date d ON ft.date_key = d.date_key
-        WHERE ft.realized_pnl IS NOT NULL
-        GROUP BY d.date
-        ORDER BY d.date;
-    """)
+    # VaR, Expected Shortfall and the daily P&L moments are computed in the database
+    tail = 1 - confidence_level / 100
+    pnl_summary, _ = get_risk_distribution('Daily Portfolio P&L', tail_percentile=tail)
     
-    if not daily_pnl.empty:
-        # Calculate VaR
-        pnl_values = daily_pnl['daily_pnl'].dropna()
-        var_percentile = (100 - confidence_level) / 100
-        var_value = np.percentile(pnl_values, var_percentile * 100)
+    # Daily P&L for the time series and the per-account risk metrics, fetched together
+    daily_pnl, account_risk = get_page_metrics_batch('daily_pnl', 'account_risk')
+    
+    if pnl_summary is not None and not daily_pnl.empty:
+        var_value = pnl_summary['tail_cutoff']
         
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5 = st.columns(5)
         
         with col1:
-            st.metric("VaR (95%)", f"${var_value:,.0f}")
+            st.metric(f"VaR ({confidence_level}%)", f"${var_value:,.0f}")
         with col2:
-            st.metric("Mean Daily P&L", f"${pnl_values.mean():,.0f}")
+            st.metric(f"Expected Shortfall ({confidence_level}%)", f"${pnl_summary['tail_mean']:,.0f}")
         with col3:
-            st.metric("Std Dev", f"${pnl_values.std():,.0f}")
+            st.metric("Mean Daily P&L", f"${pnl_summary['mean']:,.0f}")
         with col4:
-            st.metric("Min Daily P&L", f"${pnl_values.min():,.0f}")
-        
-        # P&L Distribution
-        st.subheader("📈 Daily P&L Distribution")
+            st.metric("Std Dev", f"${pnl_summary['stddev']:,.0f}")
+        with col5:
+            st.metric("Min Daily P&L", f"${pnl_summary['min']:,.0f}")
         
-        fig = go.Figure()
-        fig.add_trace(go.Histogram(
-            x=pnl_values,
-            nbinsx=50,
-            name='Daily P&L',
-            marker_color='#1e3a8a'
-        ))
+        # P&L Distribution, bucketed in the database
+        st.subheader("📈 P&L Distribution")
         
-        # Add VaR line
-        fig.add_vline(
-            x=var_value,
-            line_dash="dash",
-            line_color="#f59e0b",
-            annotation_text=f"VaR ({confidence_level}%)"
-        )
+        distribution = st.selectbox("Distribution", list(RISK_DISTRIBUTIONS))
+        percentiles = (0.01, 0.05, 0.5, 0.95, 0.99)
+        summary, histogram = get_risk_distribution(distribution, percentiles, tail_percentile=tail)
         
-        fig.update_layout(
-            title="Distribution of Daily P&L",
-            xaxis_title="Daily P&L ($)",
-            yaxis_title="Frequency",
-            height=400
-        )
-        
-        st.plotly_chart(fig, width='stretch')
+        if summary is not None:
+            fig = go.Figure()
+            fig.add_trace(go.Bar(
+                x=(histogram['bin_start'] + histogram['bin_end']) / 2,
+                y=histogram['count'],
+                width=histogram['bin_end'] - histogram['bin_start'],
+                customdata=histogram[['bin_start', 'bin_end']].to_numpy(),
+                hovertemplate="$%{customdata[0]:,.0f} to $%{customdata[1]:,.0f}<br>%{y:,} values<extra></extra>",
+                name=distribution,
+                marker_color='#1e3a8a'
+            ))
+            
+            # Add VaR line (the same percentile for the other distributions)
+            fig.add_vline(
+                x=summary['tail_cutoff'],
+                line_dash="dash",
+                line_color="#f59e0b",
+                annotation_text=(f"VaR ({confidence_level}%)" if distribution == 'Daily Portfolio P&L'
+                                 else f"{percentile_column(tail)[1:].replace('_', '.')}th Percentile")
+            )
+            
+            fig.update_layout(
+                title=f"Distribution of {distribution}",
+                xaxis_title="P&L ($)",
+                yaxis_title="Frequency",
+                bargap=0,
+                height=400
+            )
+            
+            st.plotly_chart(fig, width='stretch')
+            st.caption(
+                f"{int(summary['count']):,} values in {len(histogram)} of {HISTOGRAM_BINS} buckets · "
+                + " · ".join(f"P{percentile_column(q)[1:].replace('_', '.')} ${summary[percentile_column(q)]:,.0f}" for q in percentiles)
+                + f" · mean ${summary['mean']:,.0f} · std dev ${summary['stddev']:,.0f}"
+            )
         
         # Time Series with VaR
         st.subheader("📊 Daily P&L Time Series")
@@ -974,35 +1477,86 @@ elif page == "⚠️ Risk Analysis":
         
         st.plotly_chart(fig_ts, width='stretch')
     
+    # VaR and Expected Shortfall of every account, desk, trader or security at once
+    st.subheader("🧮 VaR and Expected Shortfall by Entity")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        breakdown = st.selectbox("Break Down By", list(RISK_BREAKDOWNS))
+    with col2:
+        horizon = st.select_slider("Horizon (Days)", options=[1, 5, 10], value=1)
+    with col3:
+        mc_method = st.selectbox("Monte Carlo Method", MONTE_CARLO_METHODS, format_func=str.title)
+    
+    entity_risk = get_entity_risk(breakdown, confidence_level, horizon, mc_method, get_data_version())
+    
+    if not entity_risk.empty:
+        label = breakdown.lower()
+        portfolio = entity_risk.iloc[-1]
+        entities = entity_risk.iloc[:-1].sort_values('historical_var')
+        
+        # Portfolio figures by method
+        methods = pd.DataFrame({
+            'Method': ['Historical', 'Parametric (Normal)', f"Monte Carlo ({mc_method.title()})"],
+            f"VaR ({confidence_level}%)": [portfolio['historical_var'], portfolio['parametric_var'], portfolio['monte_carlo_var']],
+            f"ES ({confidence_level}%)": [portfolio['historical_es'], portfolio['parametric_es'], portfolio['monte_carlo_es']],
+        })
+        st.dataframe(
+            methods.style.format({column: '${:,.0f}' for column in methods.columns[1:]}),
+            width='stretch',
+            hide_index=True
+        )
+        
+        # Worst entities by historical VaR, compared across methods
+        worst = entities.head(20)
+        fig_entity = go.Figure()
+        for column, name, color in [('historical_var', 'Historical', '#1e3a8a'),
+                                    ('parametric_var', 'Parametric', '#3b82f6'),
+                                    ('monte_carlo_var', 'Monte Carlo', '#f59e0b')]:
+            fig_entity.add_trace(go.Bar(x=worst[label].astype(str), y=worst[column], name=name, marker_color=color))
+        fig_entity.update_layout(
+            title=f"{horizon}-Day VaR ({confidence_level}%) of the {len(worst)} Riskiest {breakdown}s",
+            xaxis_title=breakdown,
+            yaxis_title="VaR ($)",
+            barmode='group',
+            height=450,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='#1e293b', size=12)
+        )
+        st.plotly_chart(fig_entity, width='stretch')
+        
+        st.dataframe(
+            entities.drop(columns='entity').style.format({
+                'mean_pnl': '${:,.0f}',
+                'pnl_stddev': '${:,.0f}',
+                'historical_var': '${:,.0f}',
+                'historical_es': '${:,.0f}',
+                'parametric_var': '${:,.0f}',
+                'parametric_es': '${:,.0f}',
+                'monte_carlo_var': '${:,.0f}',
+                'monte_carlo_es': '${:,.0f}'
+            }),
+            width='stretch',
+            height=400,
+            hide_index=True
+        )
+        st.caption(
+            f"{len(entities):,} entities ({label} level) over {int(portfolio['active_days']):,} trading days, "
+            f"evaluated in one vectorized pass. Monte Carlo uses {SIMULATIONS:,} scenarios with a fixed seed, shared "
+            "by every entity, so figures are reproducible and the portfolio figures are consistent with their parts."
+        )
+    
     # Portfolio Risk Metrics
     st.subheader("📊 Portfolio Risk Metrics by Account")
     
-    account_risk = run_query("""
-        SELECT 
-            a.account_name,
-            COUNT(*) as trade_count,
-            SUM(ft.trade_value) as total_volume,
-            SUM(ft.realized_pnl) as total_pnl,
-            STDDEV(ft.realized_pnl) as pnl_stddev,
-            AVG(ft.realized_pnl) as avg_pnl,
-            CASE 
-                WHEN STDDEV(ft.realized_pnl) > 0 
-                THEN (AVG(ft.realized_pnl) - 0.03) / STDDEV(ft.realized_pnl)
-                ELSE 0 
-            END as sharpe_ratio
-        FROM fact_trades ft
-        JOIN dim_account a ON ft.account_key = a.account_key
-        WHERE ft.realized_pnl IS NOT NULL
-        GROUP BY a.account_key, a.account_name
-        HAVING COUNT(*) > 10
-        ORDER BY total_pnl DESC;
-    """)
-    
     if not account_risk.empty:
         fig_risk = px.scatter(
             account_risk.head(20),
             x='pnl_stddev',
             y='total_pnl',
+            error_x='pnl_stddev_ci' if 'pnl_stddev_ci' in account_risk else None,
+            error_y='total_pnl_ci' if 'total_pnl_ci' in account_risk else None,
             size='total_volume',
             color='sharpe_ratio',
             hover_data=['account_name', 'trade_count'],
@@ -1021,6 +1575,7 @@ elif page == "⚠️ Risk Analysis":
             font=dict(color='#1e293b', size=12)
         )
         st.plotly_chart(fig_risk, width='stretch')
+        show_sample_note(account_risk)
 
 # ============================================================================
 # TIME SERIES PAGE
@@ -1031,13 +1586,7 @@ elif page == "📈 Time Series":
     st.markdown("---")
     
     # Security Selection
-    securities_df = run_query("""
-        SELECT DISTINCT s.security_key, s.ticker_symbol, s.security_name
-        FROM dim_security s
-        JOIN fact_trades ft ON s.security_key = ft.security_key
-        WHERE s.is_current = TRUE
-        ORDER BY s.ticker_symbol;
-    """)
+    securities_df = get_page_metrics('security_list')
     
     if not securities_df.empty:
         selected_security = st.selectbox(
@@ -1054,45 +1603,104 @@ elif page == "📈 Time Series":
         )
         
         if len(date_range) == 2 and selected_security:
-            # Get time series data
-            time_series = run_query("""
-                SELECT 
-                    d.date,
-                    ft.trade_timestamp,
-                    ft.price,
-                    ft.trade_value,
-                    ft.quantity,
-                    ft.realized_pnl
-                FROM fact_trades ft
-                JOIN dim_date d ON ft.date_key = d.date_key
-                WHERE ft.security_key = :security_key
-                    AND d.date BETWEEN :start_date AND :end_date
-                ORDER BY ft.trade_timestamp;
-            """, params={'security_key': selected_security, 'start_date': date_range[0], 'end_date': date_range[1]})
+            ticker = securities_df[securities_df['security_key'] == selected_security]['ticker_symbol'].iloc[0]
             
-            if not time_series.empty:
-                # Price Chart
+            # Zoom within the selected range: the chart is rebuilt at a finer bar width
+            zoom_range = date_range
+            if date_range[1] > date_range[0]:
+                zoom_range = st.slider(
+                    "Zoom",
+                    min_value=date_range[0],
+                    max_value=date_range[1],
+                    value=(date_range[0], date_range[1]),
+                    step=timedelta(days=1)
+                )
+            
+            # Trades come from the in-process partition store: each month is read from
+            # PostgreSQL once, then every security and date range is sliced in memory.
+            # The chart gets at most MAX_PRICE_POINTS price bars, whatever the range.
+            trade_filter = dict(start=date_range[0], end=date_range[1], security_key=selected_security)
+            try:
+                store = get_trade_store_synced()
+                bar_width, bars = store.ohlcv(
+                    MAX_PRICE_POINTS, start=zoom_range[0], end=zoom_range[1], security_key=selected_security
+                )
+                daily_agg = store.aggregate(['date'], {
+                    'trade_value': ('trade_value', 'sum'),
+                    'quantity': ('quantity', 'sum'),
+                    'realized_pnl': ('realized_pnl', 'sum'),
+                    'price_sum': ('price', 'sum'),
+                    'trades': ('trade_id', 'count')
+                }, **trade_filter)
+            except Exception as e:
+                st.error(f"Query error: {str(e)}")
+                daily_agg = pd.DataFrame()
+            
+            if not daily_agg.empty:
+                # Price Chart (WebGL traces)
                 st.subheader("💰 Price Over Time")
-                fig_price = px.line(
-                    time_series,
-                    x='trade_timestamp',
-                    y='price',
-                    labels={'trade_timestamp': 'Time', 'price': 'Price ($)'},
-                    title=f"Price Movement: {securities_df[securities_df['security_key'] == selected_security]['ticker_symbol'].iloc[0]}"
+                fig_price = go.Figure()
+                if bar_width is None:
+                    fig_price.add_trace(go.Scattergl(
+                        x=bars['bar_start'],
+                        y=bars['close'],
+                        mode='lines',
+                        name='Trade Price',
+                        line=dict(color='#1e3a8a', width=2)
+                    ))
+                    resolution = "every trade"
+                else:
+                    # High-low band behind the closing price of each bar
+                    fig_price.add_trace(go.Scattergl(
+                        x=bars['bar_start'], y=bars['low'], mode='lines',
+                        line=dict(width=0), hoverinfo='skip', showlegend=False
+                    ))
+                    fig_price.add_trace(go.Scattergl(
+                        x=bars['bar_start'], y=bars['high'], mode='lines', name='High-Low Range',
+                        line=dict(width=0), fill='tonexty', fillcolor='rgba(30, 58, 138, 0.15)', hoverinfo='skip'
+                    ))
+                    fig_price.add_trace(go.Scattergl(
+                        x=bars['bar_start'],
+                        y=bars['close'],
+                        mode='lines',
+                        name='Close',
+                        line=dict(color='#1e3a8a', width=2),
+                        customdata=bars[['open', 'high', 'low', 'trades']].to_numpy(),
+                        hovertemplate=(
+                            "%{x}<br>Open $%{customdata[0]:.2f}  High $%{customdata[1]:.2f}<br>"
+                            "Low $%{customdata[2]:.2f}  Close $%{y:.2f}<br>%{customdata[3]} trades<extra></extra>"
+                        )
+                    ))
+                    resolution = f"{bar_width} bars"
+                
+                # Market close from the ETL's price matrix (one column slice), when available
+                price_matrix = get_price_matrix()
+                if price_matrix is not None and selected_security in price_matrix.column_index:
+                    closes = price_matrix.series(selected_security, zoom_range[0], zoom_range[1]).dropna(subset=['close'])
+                    if not closes.empty:
+                        fig_price.add_trace(go.Scattergl(
+                            x=closes['date'] + pd.Timedelta(hours=16),
+                            y=closes['close'],
+                            mode='lines',
+                            name='Market Close',
+                            line=dict(color='#f59e0b', width=2, dash='dot')
+                        ))
+                
+                fig_price.update_layout(
+                    title=f"Price Movement: {ticker} ({resolution})",
+                    xaxis_title="Time",
+                    yaxis_title="Price ($)",
+                    showlegend=len(fig_price.data) > 1,
+                    height=450
                 )
-                fig_price.update_traces(line_color='#1e3a8a', line_width=2)
                 st.plotly_chart(fig_price, width='stretch')
+                if bar_width is not None:
+                    st.caption(f"{len(bars):,} {bar_width} bars from {int(bars['trades'].sum()):,} trades. "
+                               "Narrow the zoom range for finer bars.")
                 
                 # Volume Chart
                 st.subheader("📊 Trading Volume Over Time")
                 
-                # Aggregate by day
-                daily_agg = time_series.groupby('date').agg({
-                    'trade_value': 'sum',
-                    'quantity': 'sum',
-                    'realized_pnl': 'sum'
-                }).reset_index()
-                
                 fig_volume = make_subplots(
                     rows=2, cols=1,
                     subplot_titles=('Daily Volume', 'Daily P&L'),
@@ -1132,17 +1740,119 @@ elif page == "📈 Time Series":
                 
                 st.plotly_chart(fig_volume, width='stretch')
                 
-                # Statistics
+                # Statistics (from the daily aggregates, not the individual trades)
+                trade_count = daily_agg['trades'].sum()
                 col1, col2, col3, col4 = st.columns(4)
                 
                 with col1:
-                    st.metric("Avg Price", f"${time_series['price'].mean():.2f}")
+                    st.metric("Avg Price", f"${daily_agg['price_sum'].sum() / trade_count:.2f}")
                 with col2:
-                    st.metric("Total Volume", f"${time_series['trade_value'].sum():,.0f}")
+                    st.metric("Total Volume", f"${daily_agg['trade_value'].sum():,.0f}")
                 with col3:
-                    st.metric("Total P&L", f"${time_series['realized_pnl'].sum():,.0f}")
+                    st.metric("Total P&L", f"${daily_agg['realized_pnl'].sum():,.0f}")
                 with col4:
-                    st.metric("Trade Count", f"{len(time_series):,}")
+                    st.metric("Trade Count", f"{trade_count:,}")
+
+# ============================================================================
+# ROLLING RISK & CORRELATION PAGE
+# ============================================================================
+
+elif page == "📉 Rolling Risk & Correlation":
+    st.title("📉 Rolling Risk & Correlation")
+    st.markdown("---")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        universe = st.radio("Universe", ["Securities", "Accounts"], horizontal=True)
+    with col2:
+        window = st.select_slider("Rolling Window (Trading Days)", options=[20, 60, 120], value=60)
+    
+    try:
+        stats, labels = get_rolling_stats(universe, window)
+    except Exception as e:
+        st.error(f"Query error: {str(e)}")
+        stats = None
+    
+    if stats is not None and stats.days > 1:
+        is_returns = universe == 'Securities'
+        summary = stats.summary()
+        summary.insert(1, 'name', summary['entity'].map(labels))
+        summary = summary.sort_values('volatility', ascending=False)
+        
+        # Latest window
+        st.subheader(f"📋 Latest {window}-Day Statistics")
+        amount = '{:.2%}' if is_returns else '${:,.0f}'
+        st.dataframe(
+            summary.drop(columns='entity').style.format({
+                'mean': '{:.4%}' if is_returns else '${:,.0f}',
+                'volatility': amount,
+                'sharpe': '{:.2f}',
+                'beta': '{:.2f}',
+                'drawdown': amount,
+                'max_drawdown': amount
+            }),
+            width='stretch',
+            height=400,
+            hide_index=True
+        )
+        st.caption(
+            f"Volatility and Sharpe ratio are annualized. Beta is measured against the "
+            f"{'equal-weighted mean return of all securities' if is_returns else 'daily P&L of the whole portfolio'}. "
+            f"Drawdowns are measured from the running peak of "
+            f"{'compounded returns' if is_returns else 'cumulative P&L'} since {pd.Timestamp(stats.dates[0]):%Y-%m-%d}."
+        )
+        
+        # Rolling history of a few entities
+        st.subheader("📈 Rolling Volatility, Sharpe Ratio and Drawdown")
+        selected = st.multiselect(
+            "Compare",
+            options=summary['entity'].tolist(),
+            default=summary['entity'].head(5).tolist(),
+            format_func=lambda key: str(labels.get(key, key))
+        )
+        if selected:
+            fig_rolling = make_subplots(
+                rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.06,
+                subplot_titles=('Volatility (Annualized)', 'Sharpe Ratio (Annualized)', 'Drawdown')
+            )
+            colors = px.colors.qualitative.Plotly
+            for row, statistic in enumerate(['volatility', 'sharpe', 'drawdown'], 1):
+                history = stats.history(statistic)[selected]
+                for i, key in enumerate(selected):
+                    fig_rolling.add_trace(go.Scatter(
+                        x=history.index, y=history[key], mode='lines',
+                        name=str(labels.get(key, key)), legendgroup=str(key), showlegend=row == 1,
+                        line=dict(color=colors[i % len(colors)], width=2)
+                    ), row=row, col=1)
+            fig_rolling.update_layout(
+                height=750,
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font=dict(color='#1e293b', size=12)
+            )
+            st.plotly_chart(fig_rolling, width='stretch')
+        
+        # Shrunk correlation matrix
+        st.subheader("🔗 Correlation Matrix")
+        correlation, shrinkage = get_shrunk_correlation(universe, window, get_data_version(), price_matrix_build())
+        if not correlation.empty:
+            show_count = st.slider("Entities Shown (Most Active)", 5, min(50, len(correlation)), min(20, len(correlation)))
+            shown = summary.sort_values('days_in_window', ascending=False)['name'].head(show_count).tolist()
+            fig_corr = px.imshow(
+                correlation.loc[shown, shown],
+                color_continuous_scale='RdBu_r',
+                zmin=-1, zmax=1,
+                aspect='auto',
+                title=f"{window}-Day Correlation of {'Daily Returns' if is_returns else 'Daily P&L'}"
+            )
+            fig_corr.update_layout(height=650, paper_bgcolor='rgba(0,0,0,0)', font=dict(color='#1e293b', size=12))
+            st.plotly_chart(fig_corr, width='stretch')
+            st.caption(
+                f"Estimated over all {len(correlation):,} {universe.lower()} with Ledoit-Wolf shrinkage toward "
+                f"zero correlation (intensity {shrinkage:.2f}), so pairs with few overlapping days are not overstated."
+            )
+    else:
+        st.info("Not enough daily history for rolling statistics yet.")
 
 # ============================================================================
 # DATA EXPLORER PAGE
@@ -1161,9 +1871,20 @@ elif page == "🔍 Data Explorer":
     )
     
     if query_type == "Recent Trades":
-        limit = st.slider("Number of rows", 10, 1000, 100)
+        page_size = st.slider("Rows per page", 10, 1000, 100)
+        
+        # Keyset pagination on (trade_timestamp, trade_id): a page starts right after the
+        # last row of the previous one, so every page is an index range scan, however deep.
+        # trades_cursors holds the start key of every page visited so far.
+        if st.session_state.get('trades_page_size') != page_size:
+            st.session_state.trades_page_size = page_size
+            st.session_state.trades_cursors = [None]
+        cursors = st.session_state.trades_cursors
+        after = cursors[-1]
+        
         query = f"""
             SELECT 
+                ft.trade_id,
                 ft.trade_timestamp,
                 s.ticker_symbol,
                 s.security_name,
@@ -1179,51 +1900,57 @@ elif page == "🔍 Data Explorer":
             JOIN dim_trader t ON ft.trader_key = t.trader_key
             JOIN dim_account a ON ft.account_key = a.account_key
             WHERE s.is_current = TRUE AND t.is_current = TRUE
-            ORDER BY ft.trade_timestamp DESC
-            LIMIT {limit};
+                {"AND (ft.trade_timestamp, ft.trade_id) < (:after_ts, :after_id)" if after else ""}
+            ORDER BY ft.trade_timestamp DESC, ft.trade_id DESC
+            LIMIT :limit;
         """
-        df = run_query(query)
+        params = {'limit': page_size + 1}
+        if after:
+            params.update(after_ts=after[0], after_id=after[1])
+        # One extra row tells whether there is a next page
+        df = run_query(query, params=params)
+        has_next = len(df) > page_size
+        df = df.head(page_size)
+        
+        def next_trades_page():
+            last = df.iloc[-1]
+            st.session_state.trades_cursors.append((last['trade_timestamp'].to_pydatetime(), int(last['trade_id'])))
+        
+        def previous_trades_page():
+            st.session_state.trades_cursors.pop()
+        
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            st.button("⬅️ Previous", on_click=previous_trades_page, disabled=len(cursors) == 1)
+        with col2:
+            st.button("Next ➡️", on_click=next_trades_page, disabled=not has_next)
+        with col3:
+            st.caption(f"Page {len(cursors)} · {len(df):,} trades")
         st.dataframe(df, width='stretch', height=400)
     
     elif query_type == "Top Securities":
         limit = st.slider("Number of securities", 10, 100, 20)
-        query = f"""
-            SELECT 
-                s.ticker_symbol,
-                s.security_name,
-                COUNT(*) as trade_count,
-                SUM(ft.trade_value) as total_volume,
-                AVG(ft.price) as avg_price,
-                SUM(ft.realized_pnl) as total_pnl
-            FROM fact_trades ft
-            JOIN dim_security s ON ft.security_key = s.security_key
-            WHERE s.is_current = TRUE
-            GROUP BY s.ticker_symbol, s.security_name
-            ORDER BY total_volume DESC
-            LIMIT {limit};
-        """
-        df = run_query(query)
+        df = get_metrics(
+            {'trade_count': 'trades', 'total_volume': 'volume', 'avg_price': 'avg_price', 'total_pnl': 'realized_pnl'},
+            by=['security'],
+            order_by='total_volume', descending=True, limit=limit
+        ).drop(columns=['security_key'], errors='ignore')
         st.dataframe(df.style.format({
             'total_volume': '${:,.0f}',
             'avg_price': '${:,.2f}',
-            'total_pnl': '${:,.2f}'
-        }), width='stretch', height=400)
+            'total_pnl': '${:,.2f}',
+            'total_volume_ci': '±${:,.0f}',
+            'avg_price_ci': '±${:,.2f}',
+            'total_pnl_ci': '±${:,.2f}'
+        }, na_rep=''), width='stretch', height=400)
+        show_sample_note(df)
     
     elif query_type == "Account Summary":
-        query = """
-            SELECT 
-                a.account_name,
-                a.account_type,
-                COUNT(*) as trade_count,
-                SUM(ft.trade_value) as total_volume,
-                SUM(ft.realized_pnl) as total_pnl,
-                AVG(ft.realized_pnl) as avg_pnl
-            FROM fact_trades ft
-            JOIN dim_account a ON ft.account_key = a.account_key
-            GROUP BY a.account_key, a.account_name, a.account_type
-            ORDER BY total_volume DESC;
-        """
-        df = run_query(query)
+        df = get_metrics(
+            {'trade_count': 'trades', 'total_volume': 'volume', 'total_pnl': 'realized_pnl', 'avg_pnl': 'avg_pnl'},
+            by=['account'],
+            order_by='total_volume', descending=True
+        ).drop(columns=['account_key'], errors='ignore')
         st.dataframe(df.style.format({
             'total_volume': '${:,.0f}',
             'total_pnl': '${:,.2f}',
@@ -1231,21 +1958,11 @@ elif page == "🔍 Data Explorer":
         }), width='stretch', height=400)
     
     elif query_type == "Trader Activity":
-        query = """
-            SELECT 
-                t.full_name,
-                t.desk_name,
-                COUNT(*) as trade_count,
-                COUNT(DISTINCT ft.date_key) as trading_days,
-                SUM(ft.trade_value) as total_volume,
-                SUM(ft.realized_pnl) as total_pnl
-            FROM fact_trades ft
-            JOIN dim_trader t ON ft.trader_key = t.trader_key
-            WHERE t.is_current = TRUE
-            GROUP BY t.trader_key, t.full_name, t.desk_name
-            ORDER BY total_pnl DESC;
-        """
-        df = run_query(query)
+        df = get_metrics(
+            {'trade_count': 'trades', 'trading_days': 'trading_days', 'total_volume': 'volume', 'total_pnl': 'realized_pnl'},
+            by=['trader'],
+            order_by='total_pnl', descending=True
+        ).drop(columns=['trader_key'], errors='ignore')
         st.dataframe(df.style.format({
             'total_volume': '${:,.0f}',
             'total_pnl': '${:,.2f}'
@@ -1647,6 +2364,24 @@ elif page == "🏗️ Data Warehouse Architecture":
             )
         else:
             st.info("No materialized views found.")
+        
+        # Last refresh of every aggregate, recorded by the ETL refresh jobs
+        has_refresh_log = run_query("SELECT to_regclass('mv_refresh_log') IS NOT NULL as has_log;")
+        if not has_refresh_log.empty and has_refresh_log['has_log'].iloc[0]:
+            refresh_status = run_query("""
+                SELECT DISTINCT ON (view_name)
+                    view_name,
+                    refresh_mode,
+                    status,
+                    finished_at as last_refreshed,
+                    duration_ms,
+                    rows_affected
+                FROM mv_refresh_log
+                ORDER BY view_name, started_at DESC;
+            """)
+            if not refresh_status.empty:
+                st.markdown("#### Last Refresh")
+                st.dataframe(refresh_status, width='stretch', hide_index=True)
     
     # ========================================================================
     # TABLE EXPLORER TAB
@@ -1734,16 +2469,50 @@ elif page == "🏗️ Data Warehouse Architecture":
                 
                 # Export option
                 st.markdown("---")
-                if st.button(f"📥 Export {selected_table} Data (CSV)"):
-                    export_data = run_query(f"SELECT * FROM {selected_table};")
-                    if not export_data.empty:
-                        csv = export_data.to_csv(index=False)
-                        st.download_button(
-                            label="Download CSV",
-                            data=csv,
-                            file_name=f"{selected_table}.csv",
-                            mime="text/csv"
-                        )
+                export_format = st.radio("Export format", ["CSV", "Parquet"], horizontal=True)
+                if st.button(f"📥 Export {selected_table} Data ({export_format})"):
+                    mime = "text/csv" if export_format == "CSV" else "application/vnd.apache.parquet"
+                    file_name = f"{selected_table}.{export_format.lower()}"
+                    cleanup_exports()
+                    try:
+                        if st.get_option('server.enableStaticServing'):
+                            # Streamed from a server-side cursor to a file the browser downloads
+                            # straight from disk, so the table is never held in memory
+                            path = export_table(selected_table, export_format)
+                            st.markdown(
+                                f'<a href="{EXPORT_URL_PATH}/{os.path.basename(path)}" download="{file_name}">'
+                                f'⬇️ Download {file_name}</a>',
+                                unsafe_allow_html=True
+                            )
+                            st.caption(f"{os.path.getsize(path) / 1024**2:,.1f} MB · "
+                                       f"the link expires after {EXPORT_TTL_SECONDS // 60} minutes")
+                        else:
+                            # st.download_button keeps the whole file in memory for the session
+                            row_count = int(run_query(f"SELECT COUNT(*) as n FROM {selected_table};")['n'].iloc[0])
+                            limit = EXPORT_MAX_DOWNLOAD_ROWS[export_format]
+                            if row_count > limit:
+                                st.warning(
+                                    f"{selected_table} has {row_count:,} rows, more than the {limit:,} that can be "
+                                    f"downloaded as {export_format} without static file serving. "
+                                    + ("Choose Parquet, which is several times smaller, or enable "
+                                       if export_format == "CSV" else "Enable ")
+                                    + "`server.enableStaticServing` to download it from disk."
+                                )
+                            else:
+                                path = export_table(selected_table, export_format, directory=tempfile.gettempdir())
+                                try:
+                                    with open(path, 'rb') as f:
+                                        export_data = f.read()
+                                finally:
+                                    os.remove(path)
+                                st.download_button(
+                                    label=f"Download {export_format}",
+                                    data=export_data,
+                                    file_name=file_name,
+                                    mime=mime
+                                )
+                    except Exception as e:
+                        st.error(f"Export error: {str(e)}")
 
 # ============================================================================
 # FOOTER